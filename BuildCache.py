@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import hashlib
+from VMWriter import write_file
+
+class BuildCache:
+    index_name = "index.json"
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.objects = os.path.join(directory, "objects")
+        self.index_path = os.path.join(directory, BuildCache.index_name)
+        self.pending = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_saved": 0,
+            "evictions": 0
+        }
+        os.makedirs(self.objects, exist_ok=True)
+        self.entries = self.load_index()
+
+    def load_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        self.evict()
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, self.index_path)
+
+    def key(self, source, output_name, class_record, options):
+        # Class names and signatures change how identifiers and calls are
+        # compiled, so they are part of the key
+        digest = hashlib.sha256(source)
+        digest.update(b"\0")
+        digest.update(os.path.splitext(output_name)[1].encode())
+        digest.update(b"\0")
+        digest.update(options.encode())
+        digest.update(b"\0")
+        digest.update(class_record.fingerprint().encode())
+        return digest.hexdigest()
+
+    def object_path(self, key):
+        return os.path.join(self.objects, key)
+
+    def restore(self, source_name, output_name, class_record, options=""):
+        # Returns True when output_name is up to date and the file can be skipped
+        with open(source_name, "rb") as f:
+            key = self.key(f.read(), output_name, class_record, options)
+
+        entry = self.entries.get(key)
+        if entry is None:
+            self.pending[source_name] = key
+            self.stats["misses"] += 1
+            return False
+
+        try:
+            with open(self.object_path(key), "rb") as f:
+                content = f.read()
+        except OSError:
+            del self.entries[key]
+            self.pending[source_name] = key
+            self.stats["misses"] += 1
+            return False
+
+        # Written through a temporary file like a compiled output, so an
+        # interrupted restore cannot leave a partial file behind
+        write_file(output_name, content)
+
+        entry["last_used"] = time.time()
+        self.stats["hits"] += 1
+        self.stats["bytes_saved"] += len(content)
+        return True
+
+    def store(self, source_name, output_name):
+        key = self.pending.pop(source_name, None)
+        if key is None:
+            return
+        with open(output_name, "rb") as f:
+            content = f.read()
+        with open(self.object_path(key), "wb") as f:
+            f.write(content)
+        self.entries[key] = {
+            "size": len(content),
+            "last_used": time.time()
+        }
+
+    def total_size(self):
+        return sum(entry["size"] for entry in self.entries.values())
+
+    def evict(self):
+        # Least recently used entries go first
+        total = self.total_size()
+        by_age = sorted(self.entries.items(), key=lambda item: item[1]["last_used"])
+        for key, entry in by_age:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(self.object_path(key))
+            except OSError:
+                pass
+            del self.entries[key]
+            total -= entry["size"]
+            self.stats["evictions"] += 1
+
+    def report(self):
+        return "CACHE: {} hits, {} misses, {} bytes saved, {} evictions, {} bytes stored".format(
+            self.stats["hits"], self.stats["misses"], self.stats["bytes_saved"],
+            self.stats["evictions"], self.total_size())
@@ -1,11 +0,0 @@
-class ClassRecord:
-    os = ["Math", "String", "Array", "Output", "Screen", "Keyboard", "Memory", "Sys"]
-
-    def __init__(self):
-        self.classes = []
-
-    def add_name(self, name):
-        self.classes.append(name)
-    
-    def exists(self, name):
-        return name in self.classes or name in ClassRecord.os
\ No newline at end of file
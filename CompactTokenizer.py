@@ -0,0 +1,179 @@
+import re
+import mmap
+from array import array
+from JackToken import *
+from JackTokenizer import JackTokenizer, token_pattern, body_pattern
+from PhaseProfiler import null_profiler
+
+class InternTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, text):
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[text] = string_id
+            self.strings.append(text)
+        return string_id
+
+    def __len__(self):
+        return len(self.strings)
+
+class CompactTokenizer(JackTokenizer):
+    # Token categories in the order of the token_pattern groups
+    group_types = (None, SYMBOL, IDENTIFIER, INTEGER_CONSTANT, STRING_CONSTANT)
+
+    def __init__(self, filename, intern_table=None, profiler=null_profiler, source=None, deferred=False):
+        # The files of one build can share an intern_table for keyword, symbol
+        # and identifier text; string constants stay with their tokenizer
+        self.intern_table = InternTable() if intern_table is None else intern_table
+        self.types = array('B')
+        self.ids = array('I')
+        self.offsets = array('I')
+        # String constant text, indexed by the id column
+        self.constants = []
+        JackTokenizer.__init__(self, filename, profiler, source, deferred)
+
+    def tokenize_text(self, text):
+        if self.deferred:
+            self.profiler.measure("tokenize", self.defer_subroutines, text)
+        else:
+            self.profiler.measure("tokenize", self.fill_columns, text)
+
+    def append_tokens(self, text, start, end):
+        self.fill_columns(text, start, end)
+
+    def fill_columns(self, text, start=0, end=None):
+        # Matches go straight into the columns without a JackToken per token
+        intern = self.intern_table.intern
+        keywords = self.keywords
+        constants = self.constants
+        group_types = CompactTokenizer.group_types
+        types, ids, offsets = self.types.append, self.ids.append, self.offsets.append
+        for match in token_pattern.finditer(text, start, len(text) if end is None else end):
+            group = match.lastindex
+            if group is None:
+                continue
+            token = match.group(group)
+            if group == 5:
+                if token in "\"/":
+                    raise Exception("Unterminated string constant or comment")
+                raise Exception("Unexpected character {!r}".format(token))
+            token_type = group_types[group]
+            if token_type == STRING_CONSTANT:
+                ids(len(constants))
+                constants.append(token)
+            else:
+                if token_type == IDENTIFIER and token in keywords:
+                    token_type = KEYWORD
+                ids(intern(token))
+            types(token_type)
+            offsets(match.start(group))
+
+    def memory_usage(self):
+        columns = [self.types, self.ids, self.offsets]
+        return sum(column.itemsize * len(column) for column in columns)
+
+    def token_count(self):
+        return len(self.types)
+
+    def hasMoreTokens(self):
+        return self.current_index < len(self.types) - 1
+
+    def token_type(self):
+        return self.types[self.current_index]
+
+    def token(self):
+        return self.token_at(self.current_index)
+
+    def peek_token(self):
+        return self.token_at(self.current_index + 1)
+
+    def token_at(self, index):
+        if self.types[index] == STRING_CONSTANT:
+            return self.string_at(index)
+        return self.intern_table.strings[self.ids[index]]
+
+    def string_at(self, index):
+        return self.constants[self.ids[index]]
+
+# token_pattern for scanning bytes, e.g. a memory-mapped file
+byte_token_pattern = re.compile(token_pattern.pattern.encode(), token_pattern.flags & ~re.UNICODE)
+byte_body_pattern = re.compile(body_pattern.pattern.encode(), body_pattern.flags & ~re.UNICODE)
+
+class MappedTokenizer(CompactTokenizer):
+    # Scans a memory-mapped source without decoding it. String constants are
+    # not copied: their id column holds the length and the text is read back
+    # from the mapping on demand. Offsets are byte offsets into the file.
+    def __init__(self, filename, intern_table=None, profiler=null_profiler, deferred=False):
+        self.mapping = b""
+        # Raw bytes of each distinct non-string token -> (token type, string id)
+        self.known = {}
+        CompactTokenizer.__init__(self, filename, intern_table, profiler, deferred=deferred)
+
+    def tokenize_stream(self, file):
+        self.mapping = self.profiler.measure("io", self.map_source, file)
+        try:
+            self.tokenize_text(self.mapping)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        # String constants cannot be read after this
+        CompactTokenizer.close(self)
+        if isinstance(self.mapping, mmap.mmap):
+            self.mapping.close()
+
+    def map_source(self, file):
+        with open(file, "rb") as f:
+            try:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                return b""
+
+    def defer_subroutines(self, mapping):
+        CompactTokenizer.defer_subroutines(self, mapping, (byte_token_pattern, byte_body_pattern))
+
+    def block_source(self):
+        source = CompactTokenizer.block_source(self)
+        return None if source is None else source.decode()
+
+    def fill_columns(self, mapping, start=0, end=None):
+        intern = self.intern_table.intern
+        keywords = self.keywords
+        known = self.known
+        group_types = CompactTokenizer.group_types
+        types, ids, offsets = self.types.append, self.ids.append, self.offsets.append
+        for match in byte_token_pattern.finditer(mapping, start, len(mapping) if end is None else end):
+            group = match.lastindex
+            if group is None:
+                continue
+            start = match.start(group)
+            if group == 4:
+                types(STRING_CONSTANT)
+                ids(match.end(group) - start)
+                offsets(start)
+                continue
+            raw = match.group(group)
+            entry = known.get(raw)
+            if entry is None:
+                if group == 5:
+                    if raw in b"\"/":
+                        raise Exception("Unterminated string constant or comment")
+                    raise Exception("Unexpected character {!r}".format(raw.decode(errors="replace")))
+                text = raw.decode()
+                token_type = group_types[group]
+                if token_type == IDENTIFIER and text in keywords:
+                    token_type = KEYWORD
+                entry = known[raw] = (token_type, intern(text))
+            types(entry[0])
+            ids(entry[1])
+            offsets(start)
+
+    def string_at(self, index):
+        start = self.offsets[index]
+        return self.mapping[start:start + self.ids[index]].decode()
@@ -1,25 +1,94 @@
+import re
 from VMWriter import VMWriter
-from ClassRecord import ClassRecord
+from PeepholeOptimizer import PeepholeOptimizer
+from SymbolTable import SymbolTable, SEGMENTS
+from JackToken import *
+from ConstantFolding import wrap, fold_binary, fold_not, fold_neg
+import StrengthReduction
+from PhaseProfiler import null_profiler
+
+# Frames of the expression stack in compile_folded_expression
+ROOT, PARENTHESES, SUBSCRIPT, ARGUMENTS, NOT = range(5)
+
+operator_commands = {
+    "+": ("add",),
+    "-": ("sub",),
+    "*": ("call", "Math.multiply", 2),
+    "/": ("call", "Math.divide", 2),
+    "&": ("and",),
+    "|": ("or",),
+    "<": ("lt",),
+    ">": ("gt",),
+    "=": ("eq",)
+}
+keyword_values = {"true": -1, "false": 0, "null": 0}
+keyword_commands = {
+    "true": [("push", "constant", 1), ("neg",)],
+    "false": [("push", "constant", 0)],
+    "null": [("push", "constant", 0)]
+}
+expression_starts = frozenset(["(", "~", "-"])
+unary_minus_contexts = frozenset([",", "(", "="])
+
+# Words and string constants of a subroutine's source, for its cache key
+word_pattern = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+string_pattern = re.compile(r'"[^"\n]*"')
 
 class CompilationEngine:
-    def __init__(self, input, output, class_record):
+    string_initializer = "$strings"
+
+    def __init__(self, input, output, class_record, optimize=False, pool_strings=False, profiler=null_profiler,
+                 subroutine_cache=None):
         # Initialize
         self.tokenizer = input
-        self.writer = VMWriter(output)
+        self.optimize = optimize
+        self.pool_strings = pool_strings
+        if optimize:
+            self.writer = VMWriter(output, PeepholeOptimizer())
+        else:
+            self.writer = VMWriter(output)
         self.class_record = class_record
+        self.subroutine_cache = subroutine_cache
+        self.symbol_table = SymbolTable()
         self.class_name = None
-        self.label_count = 1
+        self.class_context = None
+        self.function_name = None
+        self.label_count = 0
         self.negative_term = False
         self.is_constructor = False
         self.is_method = False
-
+        self.static_count = 0
+        self.string_pool = {}
+        self.string_statistics = {
+            "strings.literals": 0,
+            "strings.pooled": 0,
+            "strings.calls_eliminated": 0,
+            "strings.startup_calls": 0
+        }
+        self.subroutine_statistics = {
+            "subroutines.compiled": 0,
+            "subroutines.reused": 0
+        }
+
+        profiler.measure("parse", self.compile_classes)
+        # Write buffered output file
+        profiler.measure("write", self.writer.close)
+
+    def compile_classes(self):
         # Traverse tokenizer
         while self.tokenizer.hasMoreTokens():
             self.compile_class()
-
-        # Close output file
-        self.writer.close()
     
+    def get_statistics(self):
+        statistics = {"instructions": len(self.writer.commands)}
+        if self.writer.optimizer:
+            statistics.update(self.writer.optimizer.get_statistics())
+        if self.pool_strings:
+            statistics.update(self.string_statistics)
+        if self.subroutine_cache is not None:
+            statistics.update(self.subroutine_statistics)
+        return statistics
+
     def token(self):
         return self.tokenizer.token()
 
@@ -32,17 +101,18 @@ class CompilationEngine:
         else:
             self.tokenizer.advance()
 
+    def symbol(self):
+        # Symbol table entry for the current identifier, or None
+        return self.symbol_table.get_symbol(self.token())
+
+    def variable(self):
+        # (segment, index) of the current identifier
+        symbol = self.symbol()
+        if symbol is None:
+            raise Exception("Undefined variable {}.".format(self.token()))
+        return SEGMENTS[symbol.get_kind()], symbol.get_index()
+
     def advance_token(self):
-        current_token = self.token()
-        current_token_type = self.type()
-        if current_token_type == "stringConstant":
-            current_token = current_token[1:-1] # Strip quotation marks
-        if current_token == "<":
-            current_token = "&lt;"
-        if current_token == ">":
-            current_token = "&gt;"
-        if current_token == "&":
-            current_token = "&amp;"
         self.tokenizer.advance()
 
     def reverse_token(self):
@@ -53,6 +123,11 @@ class CompilationEngine:
         self.verify_token("class")
         # Class name
         self.class_name = self.token()
+        self.symbol_table = SymbolTable()
+        self.symbol_table.set_class_name(self.class_name)
+        self.static_count = 0
+        self.string_pool = {}
+        self.class_context = None
         self.advance_token()
         # { symbol
         self.verify_token("{")
@@ -61,32 +136,50 @@ class CompilationEngine:
             self.compile_class_var_dec()
         # Class subroutines
         while self.token() in ["constructor", "function", "method"]:
-            self.compile_subroutine()
+            if self.subroutine_cache is None:
+                self.compile_subroutine()
+            else:
+                self.compile_cached_subroutine()
         # } symbol
         self.verify_token("}")
+        if self.pool_strings:
+            self.write_string_initializer()
 
     def compile_class_var_dec(self):
         # Class variable kind
         if self.token() == "static" or self.token() == "field":
+            kind = self.token()
+            is_static = kind == "static"
             self.advance_token()
         else:
             raise Exception("Incorrect syntax for class variable declaration.")
         # Class variable type
+        var_type = self.token()
         self.validate_type()
         # Class variable name
-        self.advance_token()
+        self.define_variable(var_type, kind)
+        total_names = 1
         # Handle list of variables
         while self.token() == ",":
             self.verify_token(",")
-            self.advance_token()
+            self.define_variable(var_type, kind)
+            total_names += 1
+        if is_static:
+            self.static_count += total_names
         # ; symbol
         self.verify_token(";")
 
+    def define_variable(self, var_type, kind):
+        if self.type() != IDENTIFIER:
+            raise Exception("Expected a variable name; received {}".format(self.token()))
+        self.symbol_table.define(self.token(), var_type, kind)
+        self.advance_token()
+
     def validate_type(self):
         current_token = self.token()
         if current_token == "int" or current_token == "char" or current_token == "boolean":
             self.advance_token()
-        elif "identifier" in self.type():
+        elif self.type() == IDENTIFIER:
             self.advance_token()
         else:
             raise Exception("Incorrect syntax for type.")
@@ -95,7 +188,7 @@ class CompilationEngine:
         current_token = self.token()
         if current_token == "int" or current_token == "char" or current_token == "boolean":
             return True
-        elif "identifier" in self.type():
+        elif self.type() == IDENTIFIER:
             return True
         else:
             return False
@@ -104,7 +197,7 @@ class CompilationEngine:
         # Subroutine type
         current_token = self.token()
         if current_token == "constructor":
-            total_fields = self.type().split(".")[1]
+            total_fields = self.symbol_table.var_count("field")
             self.is_constructor = True
             self.advance_token()
         elif current_token == "function":
@@ -125,7 +218,12 @@ class CompilationEngine:
 
         # Subroutine name
         subroutine_name = self.token()
+        self.function_name = "{}.{}".format(self.class_name, subroutine_name)
+        self.label_count = 0
         self.advance_token()
+        self.symbol_table.start_subroutine()
+        if self.is_method:
+            self.symbol_table.define("this", self.class_name, "argument")
         # ( symbol
         self.verify_token("(")
         #Parameter list
@@ -141,12 +239,14 @@ class CompilationEngine:
         while self.token() == "var":
             total_vars += self.compile_var_dec()
 
-        self.writer.write_function("{}.{}".format(self.class_name, subroutine_name), total_vars)
+        self.writer.write_function(self.function_name, total_vars)
         if self.is_constructor:
             self.allocate_memory(total_fields)
         elif self.is_method:
             self.writer.write_push("argument", 0)
             self.writer.write_pop("pointer", 0)
+        if self.pool_strings and self.class_name == "Main" and subroutine_name == "main":
+            self.initialize_string_pools()
 
         # Subroutine statements
         self.compile_statements(is_void)
@@ -154,6 +254,109 @@ class CompilationEngine:
         self.verify_token("}")
         self.is_method = False
     
+    def compile_cached_subroutine(self):
+        # Reuses the code of a subroutine compiled before in the same context;
+        # its tokens are only read when it has to be compiled
+        source = self.tokenizer.block_source()
+        if source is None:
+            self.compile_subroutine()
+            return
+        key = self.subroutine_cache.key(source, self.subroutine_context(source))
+        entry = self.subroutine_cache.get(key)
+        if entry is not None:
+            commands, strings, statistics, state = entry
+            self.writer.extend(commands)
+            for literal, slot in strings:
+                self.string_pool[literal] = slot
+            for name, count in statistics.items():
+                self.string_statistics[name] += count
+            self.negative_term, self.is_constructor = state
+            self.tokenizer.skip_block()
+            self.subroutine_statistics["subroutines.reused"] += 1
+            return
+
+        self.tokenizer.load_block()
+        mark = self.writer.mark()
+        pooled = len(self.string_pool)
+        statistics = dict(self.string_statistics)
+        self.compile_subroutine()
+        strings = list(self.string_pool.items())[pooled:]
+        statistics = {name: count - statistics[name] for name, count in self.string_statistics.items()}
+        self.subroutine_cache.put(key, (self.writer.commands[mark:], strings, statistics,
+                                        (self.negative_term, self.is_constructor)))
+        self.subroutine_statistics["subroutines.compiled"] += 1
+
+    def subroutine_context(self, source):
+        # Everything outside the subroutine's source that its code depends on.
+        # Words and literals are read from the raw text, so ones in comments
+        # count too; that only makes the key stricter.
+        if self.class_context is None:
+            class_symbols = [(name, symbol.get_type(), symbol.get_kind(), symbol.get_index())
+                             for name, symbol in self.symbol_table.class_scope.items()]
+            class_types = set(symbol.get_type() for symbol in self.symbol_table.class_scope.values())
+            self.class_context = (self.class_name, class_symbols, class_types | set([self.class_name]))
+        class_name, class_symbols, class_types = self.class_context
+
+        # Signatures of the subroutines it may call: those named in its source,
+        # of its own class, the classes it names and the types of class variables
+        names = set(word_pattern.findall(source))
+        signatures = []
+        for name in sorted(class_types | names):
+            signature = self.class_record.get_class(name)
+            if signature is not None:
+                subroutines = signature.subroutines
+                signatures.append((name, [(subroutine_name, subroutines[subroutine_name].to_json())
+                                          for subroutine_name in sorted(names) if subroutine_name in subroutines]))
+
+        context = [class_name, class_symbols, signatures, self.optimize, self.pool_strings,
+                   self.negative_term, self.is_constructor]
+        if self.pool_strings:
+            # Slots of pooled literals depend on what earlier subroutines pooled
+            literals = sorted(set(string_pattern.findall(source)))
+            if literals:
+                context.append((self.static_count, len(self.string_pool),
+                                [(literal, self.string_pool.get(literal)) for literal in literals]))
+            if class_name == "Main" and "main" in names:
+                context.append(sorted(self.class_record.classes))
+        return context
+
+    def initialize_string_pools(self):
+        # Every class builds its pooled literals once, before the program starts
+        for class_name in sorted(self.class_record.classes):
+            self.writer.write_call("{}.{}".format(class_name, CompilationEngine.string_initializer), 0)
+            self.writer.write_pop("temp", 0)
+            self.string_statistics["strings.startup_calls"] += 1
+
+    def write_string_initializer(self):
+        self.writer.write_function("{}.{}".format(self.class_name, CompilationEngine.string_initializer), 0)
+        for literal, slot in self.string_pool.items():
+            self.write_string(literal)
+            self.writer.write_pop("static", slot)
+        self.writer.write_push("constant", 0)
+        self.writer.write_return()
+
+    def write_string(self, literal):
+        # literal still carries its quotation marks
+        self.writer.write_push("constant", len(literal) - 2)
+        self.writer.write_call("String.new", 1)
+        for letter in literal[1:-1]:
+            self.writer.write_push("constant", ord(letter))
+            self.writer.write_call("String.appendChar", 2)
+
+    def compile_pooled_string(self, literal):
+        # Each use no longer calls String.new plus one appendChar per character;
+        # those calls now run once at startup for each distinct literal
+        slot = self.string_pool.get(literal)
+        calls = len(literal) - 1
+        self.string_statistics["strings.literals"] += 1
+        self.string_statistics["strings.calls_eliminated"] += calls
+        if slot is None:
+            slot = self.static_count + len(self.string_pool)
+            self.string_pool[literal] = slot
+            self.string_statistics["strings.pooled"] += 1
+            self.string_statistics["strings.startup_calls"] += calls
+        self.writer.write_push("static", slot)
+
     def allocate_memory(self, total_fields):
         self.writer.write_push("constant", total_fields)
         self.writer.write_call("Memory.alloc", 1)
@@ -162,27 +365,30 @@ class CompilationEngine:
     def compile_parameter_list(self):
         while self.is_type():
             # Variable type
+            var_type = self.token()
             self.validate_type()
             # Variable name
-            self.advance_token()
+            self.define_variable(var_type, "argument")
             # Further parameters
             while self.token() == ",":
                 self.verify_token(",")
+                var_type = self.token()
                 self.validate_type()
-                self.advance_token()
+                self.define_variable(var_type, "argument")
 
     def compile_var_dec(self):
         total_vars = 0
 
         # Variable declarations
         self.verify_token("var")
+        var_type = self.token()
         self.validate_type()
-        self.advance_token()
+        self.define_variable(var_type, "var")
         total_vars += 1
 
         while self.token() == ",":
             self.verify_token(",")
-            self.advance_token()
+            self.define_variable(var_type, "var")
             total_vars += 1
 
         self.verify_token(";")
@@ -213,24 +419,7 @@ class CompilationEngine:
         self.verify_token("do")
         
         # Peek at next token
-        self.tokenizer.advance()
-        next_token = self.token()
-        self.tokenizer.reverse()
-
-        # Translate segments
-        current_token_type = self.type().split(".")
-        current_segment = current_token_type[1]
-        if current_segment == "var":
-            current_segment = "local"
-        if current_segment == "field":
-            current_segment = "this"
-        if current_segment == "subroutine":
-            current_segment = "pointer"
-        
-        # Push onto the stack
-        current_index = current_token_type[4]
-        if not self.class_record.exists(self.token()): 
-            self.writer.write_push(current_segment, current_index)
+        next_token = self.tokenizer.peek_token()
 
         # Make subroutine call
         self.compile_subroutine_call(next_token)
@@ -248,13 +437,7 @@ class CompilationEngine:
         self.verify_token("let")
 
         # Variable name
-        current_var = self.type()
-        current_var_kind = current_var.split(".")[1]
-        current_var_index = current_var.split(".")[4]
-        if "field" in current_var_kind:
-            current_var_kind = "this"
-        elif "var" in current_var_kind:
-            current_var_kind = "local"
+        current_var_kind, current_var_index = self.variable()
         
         self.advance_token()
         
@@ -273,17 +456,6 @@ class CompilationEngine:
         
         self.verify_token("=")
 
-        # Check for method call
-        current_token_type = self.type().split(".")
-        if len(current_token_type) > 4:
-            current_index = current_token_type[4]
-            current_segment = current_token_type[1]
-            self.tokenizer.advance()
-            next_token = self.token()
-            self.tokenizer.reverse()
-            if current_segment == "field" and self.is_method and next_token == ".": 
-                self.writer.write_push("this", current_index)
-
         self.compile_expression()
         self.verify_token(";")
 
@@ -294,7 +466,7 @@ class CompilationEngine:
         self.writer.write_pop(current_var_kind, current_var_index)
 
     def compile_while(self):
-        label_one,label_two = self.create_label(), self.create_label()
+        label_one, label_two = self.create_labels("WHILE", "WHILE_END")
         
         self.writer.write_label(label_one)
         self.verify_token("while")
@@ -332,7 +504,7 @@ class CompilationEngine:
             self.advance_token()
 
     def compile_if(self):
-        label_one,label_two, label_three = self.create_label(), self.create_label(), self.create_label()
+        label_one, label_two, label_three = self.create_labels("IF_TRUE", "IF_FALSE", "IF_END")
 
         self.verify_token("if")
         self.verify_token("(")
@@ -358,150 +530,223 @@ class CompilationEngine:
         else:
             self.writer.write_label(label_two) 
 
-    def create_label(self):
-        label = "L{}".format(self.label_count)
+    def create_labels(self, *kinds):
+        # Labels of one statement share a number counted per subroutine, so
+        # editing one subroutine leaves the labels of the others unchanged
         self.label_count += 1
-        return label
+        return ["{}${}_{}".format(self.function_name, kind, self.label_count) for kind in kinds]
 
     def compile_expression(self):
-        self.compile_term()
-        while self.is_op():
-            current_op = self.token()
-            self.advance_token()
-            self.compile_term()
-            self.write_op(current_op)
-
-    def compile_term(self):
-        current_token = self.token()
-        current_token_type = self.type()
-        keyword_constants = ["this"]
-        
-        if current_token_type == "integerConstant":
-            self.writer.write_push("constant", current_token)
-            if self.negative_term:
-                self.writer.write_artihmetic("neg")
-            self.negative_term = False
-            self.advance_token()
-        elif current_token_type == "stringConstant":
-            # Get length of string (excluse quotation marks)
-            string_length = len(current_token) - 2
-            self.writer.write_push("constant", string_length) 
-            # Construct new string
-            self.writer.write_call("String.new", 1)
-            # Build new string
-            for letter in current_token:
-                unicode_code = ord(letter)
-                # Excluse quotation marks
-                if unicode_code != 34:
-                    self.writer.write_push("constant", unicode_code)
-                    self.writer.write_call("String.appendChar", 2)
-            self.advance_token()
-        elif current_token in keyword_constants:
-            self.writer.write_push("pointer", 0)
-            self.advance_token()
-        elif current_token == "true":
-            self.writer.write_push("constant", 1)
-            self.writer.write_artihmetic("neg")
-            self.advance_token()
-        elif current_token == "false" or current_token == "null":
-            self.writer.write_push("constant", 0)
-            self.advance_token()
-        elif current_token == "(":
-            self.verify_token("(")
-            self.compile_expression()
-            self.verify_token(")")
-        elif current_token == "~":
-            self.advance_token()
-            self.compile_term()
-            self.writer.write_artihmetic("not")
-        elif current_token == "-":
-            self.reverse_token()
-            previous_token = self.token()
-            self.advance_token()
-
-            if previous_token in [",", "(", "="]:
-                self.negative_term = True
-            
-            self.advance_token()
-            self.compile_term()
-
-        elif "identifier" in current_token_type:
-            def assign_and_push():
-                identifier_parts = self.type().split(".")
-                if identifier_parts[1] == "var":
-                    identifier_parts[1] = "local"
-                if identifier_parts[1] == "field":
-                    identifier_parts[1] = "this"
-
-                self.writer.write_push(identifier_parts[1], identifier_parts[4])
-
-            self.tokenizer.advance()
-            next_token = self.token()
-            self.tokenizer.reverse()
-
-            if next_token == "[":
-                assign_and_push()
-                self.advance_token()
-
-                self.verify_token("[")
-                self.compile_expression()
-                self.verify_token("]")
-
-                self.writer.write_artihmetic("add")
-                self.writer.write_pop("pointer", 1)
-                self.writer.write_push("that", 0)
-            elif next_token == "(" or next_token == ".":
-                self.compile_subroutine_call(next_token)
+        value = self.compile_folded_expression()
+        if value is not None:
+            self.write_constant(value)
+
+    def compile_folded_expression(self):
+        # Returns the value of a constant expression (nothing is emitted),
+        # or None once the code for the expression has been written.
+        # Nesting is kept on an explicit stack instead of recursing, so depth
+        # is unlimited. A frame is [kind, value, op, mark, call name, arguments];
+        # value and op belong to the expression being built in that frame.
+        tokenizer = self.tokenizer
+        writer = self.writer
+        stack = [[ROOT, None, None, 0, None, 0]]
+        while True:
+            # Parse one term; openers and prefixes push a frame and start over
+            token = tokenizer.token()
+            token_type = tokenizer.token_type()
+            if token_type == IDENTIFIER:
+                next_token = tokenizer.peek_token()
+                if next_token == "[":
+                    writer.write_push(*self.variable())
+                    tokenizer.advance()
+                    self.verify_token("[")
+                    stack.append([SUBSCRIPT, None, None, 0, None, 0])
+                    continue
+                elif next_token == "(" or next_token == ".":
+                    name, total_arguments = self.compile_call_prefix(next_token)
+                    if self.is_expression():
+                        stack.append([ARGUMENTS, None, None, 0, name, total_arguments])
+                        continue
+                    self.verify_token(")")
+                    self.write_subroutine_call(name, total_arguments)
+                else:
+                    writer.write_push(*self.variable())
+                    tokenizer.advance()
+                value = None
+            elif token_type == INTEGER_CONSTANT:
+                value = None
+                if self.optimize:
+                    value = wrap(int(token))
+                    if self.negative_term:
+                        value = fold_neg(value)
+                else:
+                    writer.write_push("constant", int(token))
+                    if self.negative_term:
+                        writer.write_artihmetic("neg")
+                self.negative_term = False
+                tokenizer.advance()
+            elif token_type == STRING_CONSTANT:
+                if self.pool_strings:
+                    self.compile_pooled_string(token)
+                else:
+                    self.write_string(token)
+                tokenizer.advance()
+                value = None
+            elif token == "(":
+                tokenizer.advance()
+                stack.append([PARENTHESES, None, None, 0, None, 0])
+                continue
+            elif token == "~":
+                tokenizer.advance()
+                stack.append([NOT, None, None, 0, None, 0])
+                continue
+            elif token == "-":
+                # Only a minus after , ( or = negates, and only the next integer constant
+                if self.get_previous_token() in unary_minus_contexts:
+                    self.negative_term = True
+                tokenizer.advance()
+                continue
+            elif token == "this":
+                writer.write_push("pointer", 0)
+                tokenizer.advance()
+                value = None
+            elif token in keyword_values:
+                tokenizer.advance()
+                value = keyword_values[token]
+                if not self.optimize:
+                    writer.extend(keyword_commands[token])
+                    value = None
             else:
-                assign_and_push()
-                self.advance_token()
+                raise Exception("Incorrect syntax for term.")
+
+            # Hand the term to the frames waiting for it until one wants another term
+            while True:
+                frame = stack[-1]
+                kind = frame[0]
+                if kind == NOT:
+                    stack.pop()
+                    if value is not None:
+                        value = fold_not(value)
+                    else:
+                        writer.write_artihmetic("not")
+                    continue
+
+                if frame[2] is None:
+                    frame[1] = value
+                else:
+                    frame[1] = self.combine_operands(frame[2], frame[1], value, frame[3])
+                if tokenizer.token() in operator_commands:
+                    frame[2] = tokenizer.token()
+                    tokenizer.advance()
+                    frame[3] = writer.mark()
+                    break
+
+                stack.pop()
+                value = frame[1]
+                if kind == ROOT:
+                    return value
+                elif kind == PARENTHESES:
+                    self.verify_token(")")
+                    continue
+
+                # Subscripts and arguments need the value on the stack
+                if value is not None:
+                    self.write_constant(value)
+                value = None
+                if kind == SUBSCRIPT:
+                    self.verify_token("]")
+                    writer.write_artihmetic("add")
+                    writer.write_pop("pointer", 1)
+                    writer.write_push("that", 0)
+                    continue
+
+                frame[5] += 1
+                if tokenizer.token() == ",":
+                    tokenizer.advance()
+                    frame[1] = frame[2] = None
+                    stack.append(frame)
+                    break
+                self.verify_token(")")
+                self.write_subroutine_call(frame[4], frame[5])
+
+    def combine_operands(self, op_symbol, value, operand, mark):
+        # value and operand are folded constants or None when their code was
+        # written; the operand's code starts at mark. Returns the folded result.
+        if value is not None and operand is not None:
+            folded = fold_binary(op_symbol, value, operand)
+            if folded is not None:
+                return folded
+
+        if value is not None and op_symbol == "*":
+            # Multiplication commutes, so the constant can be applied afterwards
+            self.write_op(op_symbol, value)
+        elif value is not None:
+            # The left operand has to be pushed before the right operand's code
+            right_operand = self.writer.take(mark)
+            self.write_constant(value)
+            self.writer.extend(right_operand)
+            # operand is still a constant here when folding failed, e.g. for 7 / 0
+            self.write_op(op_symbol, operand)
         else:
-            raise Exception("Incorrect syntax for term.")
-    
-    def write_op(self, op_symbol):
-        if op_symbol == "+":
-            self.writer.write_artihmetic("add")
-        elif op_symbol == "-":
-            self.writer.write_artihmetic("sub")
-        elif op_symbol == "-":
-            self.writer.write_artihmetic("neg")
-        elif op_symbol == "=":
-            self.writer.write_artihmetic("eq")
-        elif op_symbol == ">":
-            self.writer.write_artihmetic("gt")
-        elif op_symbol == "<":
-            self.writer.write_artihmetic("lt")
-        elif op_symbol == "&":
-            self.writer.write_artihmetic("and")
-        elif op_symbol == "|":
-            self.writer.write_artihmetic("or")
-        elif op_symbol == "!":
+            self.write_op(op_symbol, operand)
+        return None
+
+    def write_constant(self, value):
+        if value >= 0:
+            self.writer.write_push("constant", value)
+        elif value == -0x8000:
+            self.writer.write_push("constant", 0x7fff)
             self.writer.write_artihmetic("not")
-        elif op_symbol == "*":
-            self.writer.write_call("Math.multiply", 2)
-        elif op_symbol == "/":
-            self.writer.write_call("Math.divide", 2)
         else:
+            self.writer.write_push("constant", -value)
+            self.writer.write_artihmetic("neg")
+
+    def write_op(self, op_symbol, constant=None):
+        # constant is a folded operand that has not been pushed yet
+        if constant is not None:
+            sequence = StrengthReduction.reduce(op_symbol, constant)
+            if sequence is not None:
+                self.writer.extend(sequence)
+                return
+            self.write_constant(constant)
+
+        command = operator_commands.get(op_symbol)
+        if command is None:
             raise Exception("Operation {} not recognized.".format(op_symbol))
+        self.writer.extend([command])
 
-    
     def compile_subroutine_call(self, token):
+        name, total_arguments = self.compile_call_prefix(token)
+        total_arguments += self.compile_expression_list()
+        # ) symbol
+        self.verify_token(")")
+        self.write_subroutine_call(name, total_arguments)
+
+    def compile_call_prefix(self, token):
+        # Consumes everything up to and including (, pushes the object for a
+        # method call and returns the function name and the number of
+        # arguments pushed so far
         # Class/Variable name
         name_token = self.token()
-        total_arguments = 0
         if token == "(":
+            # Without a known signature the target is taken to be a method
+            signature = self.signature(self.class_name, name_token)
             self.advance_token()
             self.verify_token("(")
-            total_arguments += self.compile_expression_list()
-            self.verify_token(")")
-            self.writer.write_call("{}.{}".format(self.class_name, name_token), total_arguments + 1)
+            name = "{}.{}".format(self.class_name, name_token)
+            if signature is not None and signature.kind != "method":
+                return name, 0
+            self.writer.write_push("pointer", 0)
+            return name, 1
         elif token == ".":
-            # Check if type exists
-            identifier_parts = self.type().split(".")
-            if len(identifier_parts) > 5: # Includes type
-                name_token = identifier_parts[5]
+            total_arguments = 0
+            # A variable calls a method of its declared type
+            symbol = self.symbol()
+            if symbol is not None:
+                self.writer.write_push(*self.variable())
+                name_token = symbol.get_type()
                 total_arguments += 1
-               
+
             self.advance_token()
             # . symbol
             self.verify_token(".")
@@ -510,19 +755,30 @@ class CompilationEngine:
             self.advance_token()
             # ( symbol
             self.verify_token("(")
-            # Expression list
-            total_arguments += self.compile_expression_list()
-            # ) symbol
-            self.verify_token(")")
-            self.writer.write_call("{}.{}".format(name_token, subroutine_name), total_arguments)
+            return "{}.{}".format(name_token, subroutine_name), total_arguments
         else:
             raise Exception("Incorrect syntax for subroutine call.")
 
+    def signature(self, class_name, subroutine_name):
+        # Signature of the call target, or None when its class has no known signature
+        class_signature = self.class_record.get_class(class_name)
+        if class_signature is None:
+            return None
+        if subroutine_name not in class_signature.subroutines:
+            raise Exception("Undefined subroutine {}.{}.".format(class_name, subroutine_name))
+        return class_signature.subroutines[subroutine_name]
+
+    def write_subroutine_call(self, name, total_arguments):
+        class_name, _, subroutine_name = name.partition(".")
+        signature = self.signature(class_name, subroutine_name)
+        if signature is not None and signature.arity() != total_arguments:
+            receiver = signature.arity() - len(signature.parameter_types)
+            raise Exception("{} takes {} arguments, {} given.".format(
+                name, len(signature.parameter_types), total_arguments - receiver))
+        self.writer.write_call(name, total_arguments)
+
     def is_op(self):
-        ops = ["+", "-", "*", "/", "&", "|", "<", ">", "="]
-        if self.token() in ops:
-            return True
-        return False
+        return self.token() in operator_commands
 
     def compile_expression_list(self):
         total_arguments = 0
@@ -536,12 +792,7 @@ class CompilationEngine:
         return total_arguments
     
     def is_expression(self):
-        constants = ["integerConstant", "stringConstant"]
-        token_type = self.type()
-        symbols = ["(", "~", "-"]
-        if token_type in constants or "identifier" in token_type or "keyword" in token_type or self.token() in symbols:
-            return True
-        return False
+        return self.type() != SYMBOL or self.token() in expression_starts
 
     def get_previous_token(self):
         self.tokenizer.reverse()
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from JackCompiler import (compile_source, get_source_index, get_output_file_name, get_list_of_files, strip_file_name,
+                          enable_subroutine_cache)
+from VMWriter import write_file
+
+# Protocol: one JSON object per line in each direction.
+#
+#   {"id": 1, "sources": {"Main": "class Main {...}"}, "class_names": [...], "optimize": false, "pool_strings": false}
+#   {"id": 2, "paths": ["project/"]}       compiles the files and writes the .vm files next to them
+#   {"id": 3, "command": "metrics"}
+#   {"id": 4, "command": "shutdown"}
+#
+# A compile request is answered with one "output" or "diagnostic" message per
+# class as soon as that class is done, followed by a "done" message. A request
+# of the wrong shape gets an "error" message.
+#
+# Paths must lie inside the server's root directory (--serve-root, by default
+# the directory it was started in). Anyone who can connect can still compile
+# and shut down the server, so the socket should only be reachable by trusted
+# users.
+
+COMPILE_FIELDS = {
+    "sources": (dict, str),
+    "paths": (list, str),
+    "class_names": (list, str),
+    "optimize": (bool, None),
+    "pool_strings": (bool, None)
+}
+
+def validate_request(request):
+    # Returns what is wrong with the shape of a request, or None
+    if not isinstance(request, dict):
+        return "a request must be a JSON object"
+    command = request.get("command", "compile")
+    if not isinstance(command, str):
+        return "command must be a string"
+    if command != "compile":
+        return None
+    for field, (field_type, item_type) in COMPILE_FIELDS.items():
+        if field not in request:
+            continue
+        value = request[field]
+        if not isinstance(value, field_type):
+            return "{} must be a JSON {}".format(field, {dict: "object", list: "array", bool: "boolean"}[field_type])
+        items = value.values() if field_type is dict else value if field_type is list else []
+        if any(not isinstance(item, item_type) for item in items):
+            return "{} must only contain strings".format(field)
+    return None
+
+def parse_address(address):
+    # "unix:/path/to/socket", "host:port" or just "port" (on localhost)
+    if address.startswith("unix:"):
+        return ("unix", address[len("unix:"):])
+    host, _, port = address.rpartition(":")
+    return ("tcp", (host or "127.0.0.1", int(port)))
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class OutputCache:
+    # In-memory LRU of compiled VM text, bounded by total size in characters
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text, index, optimize, pool_strings):
+        digest = hashlib.sha256(text.encode())
+        digest.update(b"\0")
+        digest.update(index.fingerprint().encode())
+        digest.update("\0O{}P{}".format(optimize, pool_strings).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        output = self.entries.get(key)
+        if output is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        if key in self.entries:
+            return
+        self.entries[key] = output
+        self.size += len(output)
+        while self.size > self.max_size and self.entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+class CompileServer:
+    def __init__(self, jobs=1, cache_size=64 * 1024 * 1024, history=10000, root=None):
+        # With one job compiles run on a thread so the event loop keeps serving.
+        # Every worker keeps its own cache of compiled subroutines.
+        self.root = os.path.realpath(root or os.getcwd())
+        if jobs > 1:
+            self.executor = ProcessPoolExecutor(max_workers=jobs, initializer=enable_subroutine_cache)
+        else:
+            enable_subroutine_cache()
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.cache = OutputCache(cache_size)
+        self.latencies = deque(maxlen=history)
+        self.requests = 0
+        self.errors = 0
+        self.started = time.time()
+        self.server = None
+
+    async def serve(self, address):
+        kind, location = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(location):
+                os.remove(location)
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=location)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, *location)
+        print("SERVING ON {}".format(address))
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.executor.shutdown()
+            if kind == "unix" and os.path.exists(location):
+                os.remove(location)
+
+    async def handle_connection(self, reader, writer):
+        def send(message):
+            writer.write((json.dumps(message) + "\n").encode())
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    send({"type": "error", "error": "Invalid request: {}".format(error)})
+                    continue
+                problem = validate_request(request)
+                if problem is not None:
+                    request_id = request.get("id") if isinstance(request, dict) else None
+                    send({"type": "error", "id": request_id, "error": "Invalid request: {}".format(problem)})
+                    continue
+                await self.handle_request(request, send)
+                await writer.drain()
+                if request.get("command") == "shutdown":
+                    self.server.close()
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request, send):
+        request_id = request.get("id")
+        command = request.get("command", "compile")
+        if command == "metrics":
+            send(dict(self.metrics(), type="metrics", id=request_id))
+        elif command == "shutdown":
+            send({"type": "done", "id": request_id})
+        elif command == "compile":
+            start = time.perf_counter()
+            try:
+                compiled, failed = await self.compile_request(request, send)
+            except Exception as error:
+                compiled, failed = 0, 1
+                send({"type": "diagnostic", "id": request_id, "error": "{}: {}".format(type(error).__name__, error)})
+            seconds = time.perf_counter() - start
+            self.requests += 1
+            self.errors += failed
+            self.latencies.append(seconds)
+            send({"type": "done", "id": request_id, "classes": compiled, "errors": failed,
+                  "seconds": round(seconds, 6)})
+        else:
+            send({"type": "error", "id": request_id, "error": "Unknown command {}".format(command)})
+
+    async def compile_request(self, request, send):
+        # Returns (classes compiled, classes failed)
+        request_id = request.get("id")
+        optimize = bool(request.get("optimize", False))
+        pool_strings = bool(request.get("pool_strings", False))
+
+        units = []
+        if "paths" in request:
+            for path in request["paths"]:
+                self.check_path(path)
+                for file in get_list_of_files(path):
+                    self.check_path(file)
+                    with open(file) as f:
+                        units.append((strip_file_name(file), f.read(), get_output_file_name(file)))
+        for name, text in request.get("sources", {}).items():
+            units.append((name, text, None))
+        # Signatures of every class in the request, so calls between them are checked
+        index = get_source_index({name: text for name, text, output_name in units}, request.get("class_names", []))
+
+        loop = asyncio.get_running_loop()
+        pending = {}
+        failed = 0
+        for name, text, output_name in units:
+            key = self.cache.key(text, index, optimize, pool_strings)
+            output = self.cache.get(key)
+            if output is not None:
+                if output_name:
+                    write_file(output_name, output.encode())
+                send({"type": "output", "id": request_id, "class": name, "vm": output, "cached": True})
+                continue
+            future = loop.run_in_executor(self.executor, compile_source, text, (),
+                                          optimize, pool_strings, output_name, index)
+            pending[future] = (name, key)
+
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                name, key = pending.pop(future)
+                try:
+                    output = future.result()
+                except Exception as error:
+                    failed += 1
+                    send({"type": "diagnostic", "id": request_id, "class": name,
+                          "error": "{}: {}".format(type(error).__name__, error)})
+                    continue
+                self.cache.put(key, output)
+                send({"type": "output", "id": request_id, "class": name, "vm": output, "cached": False})
+        return len(units) - failed, failed
+
+    def check_path(self, path):
+        # Resolves symbolic links, so a link cannot lead out of the root either
+        real_path = os.path.realpath(path)
+        if os.path.commonpath([self.root, real_path]) != self.root:
+            raise Exception("Path {} is outside the server root {}".format(path, self.root))
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "latency_ms": {
+                "mean": round(1000 * sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                "p50": round(1000 * percentile(latencies, 0.5), 3),
+                "p95": round(1000 * percentile(latencies, 0.95), 3),
+                "p99": round(1000 * percentile(latencies, 0.99), 3),
+                "max": round(1000 * latencies[-1], 3) if latencies else 0.0
+            },
+            "cache": {
+                "hits": self.cache.hits,
+                "misses": self.cache.misses,
+                "entries": len(self.cache.entries),
+                "size": self.cache.size
+            }
+        }
+
+async def send_request(address, request):
+    # Minimal client: sends one request and collects the messages up to "done"
+    kind, location = parse_address(address)
+    if kind == "unix":
+        reader, writer = await asyncio.open_unix_connection(location)
+    else:
+        reader, writer = await asyncio.open_connection(*location)
+    writer.write((json.dumps(request) + "\n").encode())
+    await writer.drain()
+    messages = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        message = json.loads(line)
+        messages.append(message)
+        if message["type"] in ["done", "metrics", "error"]:
+            break
+    writer.close()
+    return messages
+
+def serve(address, jobs=1, cache_size=64 * 1024 * 1024, root=None):
+    asyncio.run(CompileServer(jobs, cache_size, root=root).serve(address))
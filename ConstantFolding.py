@@ -0,0 +1,47 @@
+# Compile-time evaluation of Jack expressions on 16-bit two's-complement values
+
+def wrap(value):
+    return ((value + 0x8000) & 0xffff) - 0x8000
+
+def divide(x, y):
+    # Math.divide truncates toward zero
+    quotient = abs(x) // abs(y)
+    if (x < 0) != (y < 0):
+        quotient = -quotient
+    return wrap(quotient)
+
+def compare(x, y, result):
+    # Hack compares by subtracting, so only fold when x - y cannot overflow
+    if wrap(x - y) != x - y:
+        return None
+    return -1 if result else 0
+
+def fold_binary(op, x, y):
+    # Returns the folded value or None when the operation must run at runtime
+    if op == "+":
+        return wrap(x + y)
+    elif op == "-":
+        return wrap(x - y)
+    elif op == "*":
+        return wrap(x * y)
+    elif op == "/":
+        if y == 0:
+            return None
+        return divide(x, y)
+    elif op == "&":
+        return wrap(x & y)
+    elif op == "|":
+        return wrap(x | y)
+    elif op == "=":
+        return -1 if x == y else 0
+    elif op == "<":
+        return compare(x, y, x < y)
+    elif op == ">":
+        return compare(x, y, x > y)
+    return None
+
+def fold_not(x):
+    return wrap(~x)
+
+def fold_neg(x):
+    return wrap(-x)
@@ -0,0 +1,27 @@
+class DeadCodeEliminator:
+    # Sys.init calls Main.main; a program may also supply its own Sys.init
+    roots = ["Sys.init", "Main.main"]
+
+    def __init__(self):
+        self.removed_functions = []
+        self.removed_instructions = 0
+
+    def eliminate(self, program):
+        # Returns False when the program has no entry point to start from
+        if not any(root in program.functions for root in DeadCodeEliminator.roots):
+            return False
+
+        live = program.reachable(DeadCodeEliminator.roots)
+        for name in list(program.functions):
+            if name not in live:
+                self.removed_instructions += len(program.functions[name])
+                self.removed_functions.append(name)
+                program.remove_function(name)
+        return True
+
+    def report(self):
+        lines = ["DEAD CODE: {} functions, {} instructions removed".format(
+            len(self.removed_functions), self.removed_instructions)]
+        for name in sorted(self.removed_functions):
+            lines.append("    {}".format(name))
+        return "\n".join(lines)
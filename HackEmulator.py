@@ -0,0 +1,260 @@
+import sys
+import json
+import argparse
+from SignatureIndex import os_arity
+from VMEmulator import JackOS, EmulatorError, Halt, wrap, RAM_SIZE, STATIC_BASE, STACK_BASE
+
+PREDEFINED_SYMBOLS = {"SP": 0, "LCL": 1, "ARG": 2, "THIS": 3, "THAT": 4, "SCREEN": 16384, "KBD": 24576}
+PREDEFINED_SYMBOLS.update({"R{}".format(register): register for register in range(16)})
+
+ROM_SIZE = 32768
+
+# Register an OS function leaves its result in, see HackWriter.write_native
+RESULT_REGISTER = 13
+
+# Hack ALU computations as functions of A, D and M
+COMPUTATIONS = {
+    "0": lambda a, d, m: 0,
+    "1": lambda a, d, m: 1,
+    "-1": lambda a, d, m: -1,
+    "D": lambda a, d, m: d,
+    "A": lambda a, d, m: a,
+    "M": lambda a, d, m: m,
+    "!D": lambda a, d, m: ~d,
+    "!A": lambda a, d, m: ~a,
+    "!M": lambda a, d, m: ~m,
+    "-D": lambda a, d, m: wrap(-d),
+    "-A": lambda a, d, m: wrap(-a),
+    "-M": lambda a, d, m: wrap(-m),
+    "D+1": lambda a, d, m: wrap(d + 1),
+    "A+1": lambda a, d, m: wrap(a + 1),
+    "M+1": lambda a, d, m: wrap(m + 1),
+    "D-1": lambda a, d, m: wrap(d - 1),
+    "A-1": lambda a, d, m: wrap(a - 1),
+    "M-1": lambda a, d, m: wrap(m - 1),
+    "D+A": lambda a, d, m: wrap(d + a),
+    "D+M": lambda a, d, m: wrap(d + m),
+    "D-A": lambda a, d, m: wrap(d - a),
+    "D-M": lambda a, d, m: wrap(d - m),
+    "A-D": lambda a, d, m: wrap(a - d),
+    "M-D": lambda a, d, m: wrap(m - d),
+    "D&A": lambda a, d, m: d & a,
+    "D&M": lambda a, d, m: d & m,
+    "D|A": lambda a, d, m: d | a,
+    "D|M": lambda a, d, m: d | m
+}
+# Operand orders the Hack assembler accepts as well
+for computation in ["D+A", "D+M", "D&A", "D&M", "D|A", "D|M"]:
+    COMPUTATIONS[computation[2] + computation[1] + computation[0]] = COMPUTATIONS[computation]
+
+JUMPS = {
+    "JGT": lambda value: value > 0,
+    "JEQ": lambda value: value == 0,
+    "JGE": lambda value: value >= 0,
+    "JLT": lambda value: value < 0,
+    "JNE": lambda value: value != 0,
+    "JLE": lambda value: value <= 0,
+    "JMP": lambda value: True
+}
+
+# Decoded instruction kinds
+ADDRESS, COMPUTE, TRAP, STOP = range(4)
+
+def parse_line(line):
+    # Instruction text without comments and whitespace, or "" for none
+    return "".join(line.partition("//")[0].split())
+
+def assemble(lines):
+    # Returns (decoded instructions, {label: ROM address}). Variables get
+    # RAM addresses from 16 up in order of first use, as in the Hack assembler.
+    labels = {}
+    instructions = []
+    for line in lines:
+        line = parse_line(line)
+        if not line:
+            continue
+        if line.startswith("("):
+            if line[1:-1] in labels:
+                raise EmulatorError("Label {} defined twice".format(line[1:-1]))
+            labels[line[1:-1]] = len(instructions)
+        else:
+            instructions.append(line)
+
+    if len(instructions) > ROM_SIZE:
+        raise EmulatorError("Program of {} instructions does not fit the {} word ROM".format(
+            len(instructions), ROM_SIZE))
+
+    symbols = dict(PREDEFINED_SYMBOLS, **labels)
+    next_variable = STATIC_BASE
+    program = []
+    for address, instruction in enumerate(instructions):
+        if instruction.startswith("@"):
+            value = instruction[1:]
+            if value.isdigit():
+                value = int(value)
+            else:
+                if value not in symbols:
+                    if next_variable == STACK_BASE:
+                        raise EmulatorError("Too many static variables")
+                    symbols[value] = next_variable
+                    next_variable += 1
+                value = symbols[value]
+            if value > 0x7fff:
+                raise EmulatorError("Constant {} does not fit an A-instruction".format(value))
+            program.append((ADDRESS, value))
+            continue
+
+        destination, _, computation = instruction.rpartition("=")
+        computation, _, jump = computation.partition(";")
+        if computation not in COMPUTATIONS or (jump and jump not in JUMPS) or set(destination) - set("ADM"):
+            raise EmulatorError("Invalid instruction {} at {}".format(instruction, address))
+        program.append((COMPUTE, COMPUTATIONS[computation], "M" in computation,
+                        "A" in destination, "D" in destination, "M" in destination, JUMPS.get(jump)))
+
+        # An unconditional jump to the A-instruction right before it loops forever
+        if jump == "JMP" and computation == "0" and address and program[address - 1] == (ADDRESS, address - 1):
+            program[address - 1] = (STOP,)
+    return program, labels
+
+def function_starts(labels):
+    # Labels that start a function or a piece of shared code, skipping the
+    # labels inside them (function$label and function:KIND_n)
+    starts = {}
+    for name, address in labels.items():
+        prefixes = [name[:position] for position, character in enumerate(name) if position and character in "$:"]
+        if not any(prefix in labels for prefix in prefixes):
+            starts[name] = address
+    return starts
+
+class HackEmulator:
+    # Hack CPU emulator counting cycles, one per instruction. The Jack OS is
+    # not in ROM: reaching the label of an OS function runs the Python
+    # version from VMEmulator on the arguments at ARG, then continues with
+    # the instructions at the label, which return its result.
+    def __init__(self, keyboard_input=""):
+        self.ram = [0] * RAM_SIZE
+        self.os = JackOS(self, keyboard_input)
+        self.program = None
+        self.labels = {}
+        self.counts = None
+        self.native_calls = {}
+        self.cycles = 0
+
+    def load_lines(self, lines):
+        self.program, self.labels = assemble(lines)
+        # OS functions are trapped at their labels
+        for name, address in self.labels.items():
+            if name in self.os.functions:
+                self.program[address] = (TRAP, name, os_arity(name), self.program[address])
+
+    def load(self, filename):
+        with open(filename) as f:
+            self.load_lines(f.read().splitlines())
+
+    def rom_size(self):
+        return len(self.program)
+
+    def run(self, max_cycles=None):
+        if self.program is None:
+            raise EmulatorError("No program loaded")
+        ram = self.ram
+        program = self.program
+        natives = self.os.functions
+        native_calls = self.native_calls
+        counts = [0] * len(program)
+        a = d = pc = 0
+        cycles = 0
+        limit = max_cycles if max_cycles is not None else -1
+
+        try:
+            while True:
+                instruction = program[pc]
+                kind = instruction[0]
+                if kind == TRAP:
+                    name, arity = instruction[1], instruction[2]
+                    native_calls[name] = native_calls.get(name, 0) + 1
+                    arguments = ram[ram[2]:ram[2] + arity]
+                    ram[RESULT_REGISTER] = wrap(natives[name](*arguments) or 0)
+                    instruction = instruction[3]
+                    kind = instruction[0]
+                if kind == STOP:
+                    break
+                if cycles == limit:
+                    raise EmulatorError("Cycle limit of {} reached".format(max_cycles))
+                cycles += 1
+                counts[pc] += 1
+
+                if kind == ADDRESS:
+                    a = instruction[1]
+                    pc += 1
+                    continue
+                _, compute, reads_memory, store_a, store_d, store_m, jump = instruction
+                address = a & 0x7fff
+                value = compute(a, d, ram[address] if reads_memory else 0)
+                if store_m:
+                    ram[address] = value
+                if jump is not None and jump(value):
+                    pc = a
+                else:
+                    pc += 1
+                if store_a:
+                    a = value
+                if store_d:
+                    d = value
+        except Halt:
+            pass
+        finally:
+            self.cycles = cycles
+            self.counts = counts
+
+    def get_output(self):
+        return "".join(self.os.output)
+
+    def function_counts(self):
+        # Cycles spent in each function and in the shared call/return code
+        starts = sorted(function_starts(self.labels).items(), key=lambda item: item[1])
+        totals = {}
+        for position, (name, start) in enumerate(starts):
+            end = starts[position + 1][1] if position + 1 < len(starts) else len(self.counts)
+            totals[name] = totals.get(name, 0) + sum(self.counts[start:end])
+        return totals
+
+    def report(self, top=20):
+        lines = ["EXECUTED: {} cycles, {} instructions in ROM, {} OS calls".format(
+            self.cycles, self.rom_size(), sum(self.native_calls.values()))]
+        for name, count in sorted(self.function_counts().items(), key=lambda item: -item[1])[:top]:
+            if count:
+                lines.append("    {:>10}  {}".format(count, name))
+        return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument("input", help=".asm file")
+    parser.add_argument("--max-cycles", type=int, help="stop after this many instructions")
+    parser.add_argument("--keyboard", default="", help="characters fed to the Keyboard class")
+    parser.add_argument("--top", type=int, default=20, help="number of functions in the report")
+    parser.add_argument("--json", help="write cycle counts to this JSON file")
+    arguments = parser.parse_args()
+
+    emulator = HackEmulator(arguments.keyboard.replace("\\n", "\n"))
+    emulator.load(arguments.input)
+    try:
+        emulator.run(max_cycles=arguments.max_cycles)
+    finally:
+        sys.stdout.write(emulator.get_output())
+        if emulator.os.output and not emulator.get_output().endswith("\n"):
+            print("")
+        if emulator.counts is not None:
+            print(emulator.report(arguments.top))
+
+    if arguments.json:
+        with open(arguments.json, "w") as f:
+            json.dump({
+                "cycles": emulator.cycles,
+                "rom": emulator.rom_size(),
+                "functions": emulator.function_counts(),
+                "os_calls": emulator.native_calls
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+from SignatureIndex import OS_SIGNATURES
+from VMWriter import write_file
+
+# Base address registers of the pointer segments
+SEGMENT_POINTERS = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+TEMP_BASE = 5
+STACK_BASE = 256
+
+# Labels of the code outside any function. VM labels become function$label
+# and labels made up here function:KIND_n, so the two never collide.
+BOOTSTRAP_LABEL = "$bootstrap"
+# Loops forever once the entry function returns; emulators stop here
+HALT_LABEL = "$HALT"
+RETURN_LABEL = "$RETURN"
+
+# Hack computations of the binary VM commands, with x in M and y in D
+BINARY_COMPUTATIONS = {"add": "D+M", "sub": "M-D", "and": "D&M", "or": "D|M"}
+# Same with x in D and y in M (or A for constants)
+OPERAND_COMPUTATIONS = {"add": "D+{}", "sub": "D-{}", "and": "D&{}", "or": "D|{}"}
+UNARY_COMPUTATIONS = {"neg": "-", "not": "!"}
+# Jumps taken when x - y satisfies the comparison, and when it does not.
+# As in the textbook translation, x - y may overflow for operands far apart.
+COMPARISON_JUMPS = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}
+NEGATED_JUMPS = {"eq": "JNE", "gt": "JLE", "lt": "JGE"}
+
+# Pointer segment indexes reached by counting A up instead of adding through D
+ADDRESS_CHAIN_LIMIT = 8
+
+class NaiveHackWriter:
+    # Textbook translation of VM commands to Hack assembly: every command
+    # expands to a fixed sequence that goes through the stack in RAM, and
+    # every call site carries its own frame setup. Kept as the baseline the
+    # optimized HackWriter is measured against.
+    def __init__(self, output_name=None):
+        self.output_name = output_name
+        self.lines = []
+        self.unit = None
+        self.function = BOOTSTRAP_LABEL
+        self.label_count = 0
+        self.functions = set()
+        self.called = set()
+        self.statistics = {
+            "asm.calls": 0,
+            "asm.fused": 0,
+            "asm.cached": 0
+        }
+        self.changed = False
+
+    def emit(self, *instructions):
+        self.lines.extend(instructions)
+
+    def write_label_line(self, label):
+        self.lines.append("({})".format(label))
+
+    def unique_label(self, kind):
+        self.label_count += 1
+        return "{}:{}_{}".format(self.function, kind, self.label_count)
+
+    def scoped_label(self, label):
+        return "{}${}".format(self.function, label)
+
+    def address(self, segment, index):
+        # Symbol of a fixed RAM cell: statics, temps and the pointer registers
+        if segment == "static":
+            return "{}.{}".format(self.unit, index)
+        if segment == "temp":
+            return str(TEMP_BASE + index)
+        if segment == "pointer":
+            return "THAT" if index else "THIS"
+        raise Exception("Segment {} has no fixed address.".format(segment))
+
+    def write_program(self, units):
+        # units is a list of (unit name, VM commands); statics are named
+        # after the unit, so each unit needs its own name
+        for unit, commands in units:
+            self.functions.update(command[1] for command in commands if command[0] == "function")
+        if "Sys.init" in self.functions:
+            entry = "Sys.init"
+        elif "Main.main" in self.functions:
+            entry = "Main.main"
+        else:
+            raise Exception("No Sys.init or Main.main to start the program from.")
+
+        self.write_bootstrap(entry)
+        for unit, commands in units:
+            self.unit = unit
+            self.write_commands(commands)
+
+        for name in sorted(self.called - self.functions):
+            class_name, _, subroutine_name = name.partition(".")
+            if class_name not in OS_SIGNATURES or subroutine_name not in OS_SIGNATURES[class_name].subroutines:
+                raise Exception("Undefined function {}.".format(name))
+            self.write_native(name)
+        self.write_runtime()
+
+    def write_bootstrap(self, entry):
+        self.write_label_line(BOOTSTRAP_LABEL)
+        self.emit("@{}".format(STACK_BASE), "D=A", "@SP", "M=D")
+        self.write_call(entry, 0)
+        self.write_label_line(HALT_LABEL)
+        self.emit("@" + HALT_LABEL, "0;JMP")
+
+    def write_native(self, name):
+        # Body of an OS function: an emulator runs the function natively when
+        # it reaches the label and leaves the result in R13
+        self.function = name
+        self.write_label_line(name)
+        self.emit("@R13", "D=M")
+        self.push_d()
+        self.write_return()
+
+    def write_runtime(self):
+        # Shared code placed after the program; the naive translation has none
+        pass
+
+    def write_commands(self, commands):
+        index = 0
+        while index < len(commands):
+            index += self.write_command(commands, index)
+
+    def write_command(self, commands, index):
+        # Translates commands[index] and returns how many commands it used
+        command = commands[index]
+        operation = command[0]
+        if operation == "push":
+            self.write_push(command[1], int(command[2]))
+        elif operation == "pop":
+            self.write_pop(command[1], int(command[2]))
+        elif operation in BINARY_COMPUTATIONS:
+            self.write_binary(operation)
+        elif operation in UNARY_COMPUTATIONS:
+            self.write_unary(operation)
+        elif operation in COMPARISON_JUMPS:
+            self.write_comparison(operation)
+        elif operation == "label":
+            self.write_label(self.scoped_label(command[1]))
+        elif operation == "goto":
+            self.write_goto(self.scoped_label(command[1]))
+        elif operation == "if-goto":
+            self.write_if(self.scoped_label(command[1]))
+        elif operation == "function":
+            self.function = command[1]
+            self.write_function(command[1], int(command[2]))
+        elif operation == "call":
+            self.write_call(command[1], int(command[2]))
+        elif operation == "return":
+            self.write_return()
+        else:
+            raise Exception("Unknown command {}.".format(" ".join(map(str, command))))
+        return 1
+
+    def push_d(self):
+        self.emit("@SP", "A=M", "M=D", "@SP", "M=M+1")
+
+    def write_push(self, segment, index):
+        if segment == "constant":
+            self.emit("@{}".format(index), "D=A")
+        elif segment in SEGMENT_POINTERS:
+            self.emit("@{}".format(index), "D=A", "@" + SEGMENT_POINTERS[segment], "A=D+M", "D=M")
+        else:
+            self.emit("@" + self.address(segment, index), "D=M")
+        self.push_d()
+
+    def write_pop(self, segment, index):
+        if segment in SEGMENT_POINTERS:
+            self.emit("@{}".format(index), "D=A", "@" + SEGMENT_POINTERS[segment], "D=D+M", "@R13", "M=D",
+                      "@SP", "AM=M-1", "D=M", "@R13", "A=M", "M=D")
+        else:
+            self.emit("@SP", "AM=M-1", "D=M", "@" + self.address(segment, index), "M=D")
+
+    def write_binary(self, operation):
+        self.emit("@SP", "AM=M-1", "D=M", "A=A-1", "M=" + BINARY_COMPUTATIONS[operation])
+
+    def write_unary(self, operation):
+        self.emit("@SP", "A=M-1", "M={}M".format(UNARY_COMPUTATIONS[operation]))
+
+    def write_comparison(self, operation):
+        true_label, end_label = self.unique_label("TRUE"), self.unique_label("END")
+        self.emit("@SP", "AM=M-1", "D=M", "A=A-1", "D=M-D", "@" + true_label, "D;" + COMPARISON_JUMPS[operation],
+                  "@SP", "A=M-1", "M=0", "@" + end_label, "0;JMP")
+        self.write_label_line(true_label)
+        self.emit("@SP", "A=M-1", "M=-1")
+        self.write_label_line(end_label)
+
+    def write_label(self, label):
+        self.write_label_line(label)
+
+    def write_goto(self, label):
+        self.emit("@" + label, "0;JMP")
+
+    def write_if(self, label):
+        self.emit("@SP", "AM=M-1", "D=M", "@" + label, "D;JNE")
+
+    def write_function(self, name, locals_count):
+        self.write_label_line(name)
+        for _ in range(locals_count):
+            self.write_push("constant", 0)
+
+    def write_call(self, name, arguments_count):
+        self.called.add(name)
+        self.statistics["asm.calls"] += 1
+        return_label = self.unique_label("RET")
+        self.emit("@" + return_label, "D=A")
+        self.push_d()
+        for register in ["LCL", "ARG", "THIS", "THAT"]:
+            self.emit("@" + register, "D=M")
+            self.push_d()
+        self.emit("@SP", "D=M", "@{}".format(arguments_count + 5), "D=D-A", "@ARG", "M=D",
+                  "@SP", "D=M", "@LCL", "M=D", "@" + name, "0;JMP")
+        self.write_label_line(return_label)
+
+    def write_return(self):
+        self.emit("@LCL", "D=M", "@R14", "M=D",
+                  "@5", "A=D-A", "D=M", "@R15", "M=D",
+                  "@SP", "AM=M-1", "D=M", "@ARG", "A=M", "M=D",
+                  "@ARG", "D=M+1", "@SP", "M=D")
+        for register in ["THAT", "THIS", "ARG", "LCL"]:
+            self.emit("@R14", "AM=M-1", "D=M", "@" + register, "M=D")
+        self.emit("@R15", "A=M", "0;JMP")
+
+    def rom_size(self):
+        return sum(1 for line in self.lines if not line.startswith("("))
+
+    def get_output(self):
+        return "\n".join(self.lines) + "\n"
+
+    def close(self):
+        if self.output_name is not None:
+            self.changed = write_file(self.output_name, self.get_output().encode())
+
+class HackWriter(NaiveHackWriter):
+    # Translation that keeps the top of the VM stack in D between commands,
+    # so a push followed by a pop or an arithmetic command never touches
+    # the stack in RAM. At labels, jumps and calls the top is written back
+    # so every path into a label agrees. Calls and returns go through shared
+    # trampolines, and common command pairs are fused into one sequence.
+    def __init__(self, output_name=None):
+        super().__init__(output_name)
+        # True while D holds the top of the stack and RAM[SP] is free
+        self.cached = False
+        self.call_arities = set()
+
+    def spill(self):
+        if self.cached:
+            self.emit("@SP", "AM=M+1", "A=A-1", "M=D")
+            self.cached = False
+
+    def load_top(self):
+        if self.cached:
+            self.statistics["asm.cached"] += 1
+        else:
+            self.emit("@SP", "AM=M-1", "D=M")
+        self.cached = False
+
+    def address_instructions(self, segment, index):
+        # Instructions setting A to the address of segment[index] without
+        # touching D, or None when that needs D
+        if segment in SEGMENT_POINTERS:
+            if index > ADDRESS_CHAIN_LIMIT:
+                return None
+            register = "@" + SEGMENT_POINTERS[segment]
+            if index == 0:
+                return [register, "A=M"]
+            return [register, "A=M+1"] + ["A=A+1"] * (index - 1)
+        return ["@" + self.address(segment, index)]
+
+    def write_command(self, commands, index):
+        command = commands[index]
+        following = commands[index + 1:index + 3]
+        following_operations = [next_command[0] for next_command in following]
+
+        if command[0] == "push" and following_operations[:1] and following_operations[0] in OPERAND_COMPUTATIONS:
+            if self.write_operand_operation(command[1], int(command[2]), following_operations[0]):
+                return 2
+        if command[0] == "push" and command[1] == "constant" and following_operations[:1] == ["neg"]:
+            self.spill()
+            if int(command[2]) == 1:
+                self.emit("D=-1")
+            else:
+                self.emit("@{}".format(command[2]), "D=-A")
+            self.cached = True
+            self.statistics["asm.fused"] += 1
+            return 2
+        if command[0] in COMPARISON_JUMPS:
+            if following_operations == ["not", "if-goto"]:
+                self.write_comparison_jump(NEGATED_JUMPS[command[0]], self.scoped_label(following[1][1]))
+                return 3
+            if following_operations[:1] == ["if-goto"]:
+                self.write_comparison_jump(COMPARISON_JUMPS[command[0]], self.scoped_label(following[0][1]))
+                return 2
+        if command[0] == "pop" and command[1] == "pointer" and int(command[2]) == 1 and \
+                following[:1] and following[0][:2] == ("push", "that") and int(following[0][2]) == 0:
+            # Array read: the new THAT is already in D
+            self.load_top()
+            self.emit("@THAT", "M=D", "A=D", "D=M")
+            self.cached = True
+            self.statistics["asm.fused"] += 1
+            return 2
+        return super().write_command(commands, index)
+
+    def write_operand_operation(self, segment, index, operation):
+        # push x; add|sub|and|or with the pushed value used straight from
+        # memory or as a constant; returns False when that does not apply
+        if segment == "constant":
+            if index == 1 and operation in ["add", "sub"]:
+                computation = "D+1" if operation == "add" else "D-1"
+                instructions = []
+            else:
+                computation = OPERAND_COMPUTATIONS[operation].format("A")
+                instructions = ["@{}".format(index)]
+        else:
+            instructions = self.address_instructions(segment, index)
+            if instructions is None:
+                return False
+            computation = OPERAND_COMPUTATIONS[operation].format("M")
+        self.load_top()
+        self.emit(*instructions)
+        self.emit("D=" + computation)
+        self.cached = True
+        self.statistics["asm.fused"] += 1
+        return True
+
+    def write_comparison_jump(self, jump, label):
+        self.load_top()
+        self.emit("@SP", "AM=M-1", "D=M-D", "@" + label, "D;" + jump)
+        self.statistics["asm.fused"] += 1
+
+    def write_native(self, name):
+        self.function = name
+        self.write_label_line(name)
+        self.emit("@R13", "D=M", "@" + RETURN_LABEL, "0;JMP")
+
+    def push_d(self):
+        self.spill()
+        self.cached = True
+
+    def write_push(self, segment, index):
+        self.spill()
+        if segment == "constant":
+            if index in (0, 1):
+                self.emit("D={}".format(index))
+            else:
+                self.emit("@{}".format(index), "D=A")
+        else:
+            instructions = self.address_instructions(segment, index)
+            if instructions is None:
+                self.emit("@{}".format(index), "D=A", "@" + SEGMENT_POINTERS[segment], "A=D+M", "D=M")
+            else:
+                self.emit(*instructions)
+                self.emit("D=M")
+        self.cached = True
+
+    def write_pop(self, segment, index):
+        if segment == "constant":
+            raise Exception("Cannot pop to the constant segment.")
+        self.load_top()
+        instructions = self.address_instructions(segment, index)
+        if instructions is None:
+            self.emit("@R13", "M=D", "@{}".format(index), "D=A", "@" + SEGMENT_POINTERS[segment], "D=D+M",
+                      "@R14", "M=D", "@R13", "D=M", "@R14", "A=M", "M=D")
+        else:
+            self.emit(*instructions)
+            self.emit("M=D")
+
+    def write_binary(self, operation):
+        self.load_top()
+        self.emit("@SP", "AM=M-1", "D=" + BINARY_COMPUTATIONS[operation])
+        self.cached = True
+
+    def write_unary(self, operation):
+        self.load_top()
+        self.emit("D={}D".format(UNARY_COMPUTATIONS[operation]))
+        self.cached = True
+
+    def write_comparison(self, operation):
+        true_label, end_label = self.unique_label("TRUE"), self.unique_label("END")
+        self.load_top()
+        self.emit("@SP", "AM=M-1", "D=M-D", "@" + true_label, "D;" + COMPARISON_JUMPS[operation],
+                  "D=0", "@" + end_label, "0;JMP")
+        self.write_label_line(true_label)
+        self.emit("D=-1")
+        self.write_label_line(end_label)
+        self.cached = True
+
+    def write_label(self, label):
+        self.spill()
+        self.write_label_line(label)
+
+    def write_goto(self, label):
+        self.spill()
+        self.emit("@" + label, "0;JMP")
+
+    def write_if(self, label):
+        self.load_top()
+        self.emit("@" + label, "D;JNE")
+
+    def write_function(self, name, locals_count):
+        self.cached = False
+        self.write_label_line(name)
+        if locals_count == 1:
+            self.emit("@SP", "AM=M+1", "A=A-1", "M=0")
+        elif locals_count > 1:
+            self.emit("@SP", "A=M", "M=0")
+            for _ in range(locals_count - 1):
+                self.emit("A=A+1", "M=0")
+            self.emit("D=A+1", "@SP", "M=D")
+
+    def write_call(self, name, arguments_count):
+        # The trampoline takes the callee in R13 and the return address in
+        # D, and comes back with the result in D
+        self.called.add(name)
+        self.call_arities.add(arguments_count)
+        self.statistics["asm.calls"] += 1
+        self.spill()
+        return_label = self.unique_label("RET")
+        self.emit("@" + name, "D=A", "@R13", "M=D", "@" + return_label, "D=A",
+                  "@$CALL_{}".format(arguments_count), "0;JMP")
+        self.write_label_line(return_label)
+        self.cached = True
+
+    def write_return(self):
+        self.load_top()
+        self.emit("@" + RETURN_LABEL, "0;JMP")
+
+    def write_runtime(self):
+        for arguments_count in sorted(self.call_arities):
+            self.write_label_line("$CALL_{}".format(arguments_count))
+            self.emit("@SP", "A=M", "M=D")
+            for register in ["LCL", "ARG", "THIS", "THAT"]:
+                self.emit("@" + register, "D=M", "@SP", "AM=M+1", "M=D")
+            self.emit("@SP", "MD=M+1", "@LCL", "M=D",
+                      "@{}".format(arguments_count + 5), "D=D-A", "@ARG", "M=D",
+                      "@R13", "A=M", "0;JMP")
+
+        # The result stays in D; the caller's stack ends where ARG was
+        self.write_label_line(RETURN_LABEL)
+        self.emit("@R13", "M=D", "@LCL", "D=M", "@R14", "M=D", "@ARG", "D=M", "@SP", "M=D")
+        for register in ["THAT", "THIS", "ARG", "LCL"]:
+            self.emit("@R14", "AM=M-1", "D=M", "@" + register, "M=D")
+        self.emit("@R13", "D=M", "@R14", "A=M-1", "A=M", "0;JMP")
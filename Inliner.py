@@ -0,0 +1,117 @@
+class Inliner:
+    def __init__(self, max_size=12, budget=2000):
+        # max_size: largest callee body (in VM commands) worth inlining
+        # budget: how many VM commands inlining may add to the program
+        self.max_size = max_size
+        self.budget = budget
+        self.growth = 0
+        self.sites = []
+
+    def is_candidate(self, name, commands):
+        body = commands[1:]
+        if not body or len(body) > self.max_size or body[-1] != ("return",):
+            return False
+        # Recursive functions would have to be inlined into themselves
+        return ("call", name) not in [command[:2] for command in body]
+
+    def inline(self, program):
+        # Callees are expanded from their original bodies, so inlining never cascades
+        originals = {}
+        for name, commands in program.functions.items():
+            if self.is_candidate(name, commands):
+                originals[name] = list(commands)
+
+        for name in list(program.functions):
+            program.functions[name] = self.inline_calls(program, name, originals)
+
+    def can_inline(self, program, caller, callee, commands, total_arguments):
+        if callee == caller:
+            return False
+        body = commands[1:]
+        # Statics belong to the callee's file
+        if program.owners[callee] != program.owners[caller]:
+            if any(command[0] in ["push", "pop"] and command[1] == "static" for command in body):
+                return False
+        used_arguments = [command[2] for command in body if command[0] in ["push", "pop"] and command[1] == "argument"]
+        return not used_arguments or max(used_arguments) < total_arguments
+
+    def inline_calls(self, program, caller, originals):
+        commands = program.functions[caller]
+        function, name, total_locals = commands[0]
+        output = [None]
+        extra_locals = 0
+
+        for command in commands[1:]:
+            callee = command[1] if command[0] == "call" else None
+            if callee in originals and self.can_inline(program, caller, callee, originals[callee], command[2]):
+                expansion, slots = self.expand(caller, originals[callee], command[2], total_locals)
+                if self.growth + len(expansion) - 1 <= self.budget:
+                    self.growth += len(expansion) - 1
+                    self.sites.append((caller, callee))
+                    output.extend(expansion)
+                    extra_locals = max(extra_locals, slots)
+                    continue
+            output.append(command)
+
+        # Inlined bodies run one after another, so they share the extra locals
+        output[0] = (function, name, total_locals + extra_locals)
+        return output
+
+    def expand(self, caller, callee_commands, total_arguments, base):
+        site = len(self.sites)
+        callee_locals = callee_commands[0][2]
+        body = callee_commands[1:-1]
+        local_base = base + total_arguments
+        save_slot = local_base + callee_locals
+
+        sets_this = ("pop", "pointer", 0) in body
+        uses_that = any(command[0] in ["push", "pop"] and
+                        (command[1] == "that" or command[1:] == ("pointer", 1)) for command in body)
+        # Point THAT at the callee's object when THAT is free, otherwise save THIS
+        retarget = sets_this and not uses_that
+        save_this = sets_this and uses_that
+
+        def rename(label):
+            return "{}$inline{}".format(label, site)
+        end_label = rename("{}$end".format(caller))
+
+        # Arguments are on the stack, last one on top
+        expansion = [("pop", "local", base + index) for index in reversed(range(total_arguments))]
+        for index in range(callee_locals):
+            expansion += [("push", "constant", 0), ("pop", "local", local_base + index)]
+        if save_this:
+            expansion += [("push", "pointer", 0), ("pop", "local", save_slot)]
+
+        jumps_to_end = False
+        for command in body:
+            operation = command[0]
+            if operation in ["push", "pop"]:
+                segment, index = command[1], command[2]
+                if segment == "argument":
+                    segment, index = "local", base + index
+                elif segment == "local":
+                    segment, index = "local", local_base + index
+                elif retarget and segment == "this":
+                    segment = "that"
+                elif retarget and segment == "pointer" and index == 0:
+                    index = 1
+                expansion.append((operation, segment, index))
+            elif operation in ["label", "goto", "if-goto"]:
+                expansion.append((operation, rename(command[1])))
+            elif operation == "return":
+                expansion.append(("goto", end_label))
+                jumps_to_end = True
+            else:
+                expansion.append(command)
+
+        if jumps_to_end:
+            expansion.append(("label", end_label))
+        if save_this:
+            expansion += [("push", "local", save_slot), ("pop", "pointer", 0)]
+        return expansion, total_arguments + callee_locals + (1 if save_this else 0)
+
+    def report(self):
+        lines = ["INLINING: {} call sites inlined, {} instructions added".format(len(self.sites), self.growth)]
+        for caller, callee in self.sites:
+            lines.append("    {} <- {}".format(caller, callee))
+        return "\n".join(lines)
@@ -1,27 +1,87 @@
 import os
 import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from CompilationEngine import CompilationEngine
-from JackTokenizer import JackTokenizer
+from JackTokenizer import JackTokenizer, token_pattern
+from CompactTokenizer import CompactTokenizer, MappedTokenizer, InternTable
 from SymbolTable import SymbolTable
-from ClassRecord import ClassRecord
+from SignatureIndex import SignatureIndex
+from BuildCache import BuildCache
+from SubroutineCache import SubroutineCache
+from VMWriter import VMWriter
+from HackWriter import HackWriter, NaiveHackWriter
+from VMProgram import VMProgram
+from DeadCodeEliminator import DeadCodeEliminator
+from Inliner import Inliner
+from PeepholeOptimizer import format_report as format_peephole_report
+import PhaseProfiler
 
-def create_output_file(filename):
-        currentFileName = filename.partition(".")[0]
-        outputFileName = currentFileName + ".vm"
+# Compiled subroutines reused between compiles in this process, see enable_subroutine_cache
+subroutine_cache = None
+
+def get_output_file_name(filename, output_format="vm"):
+    return os.path.splitext(filename)[0] + "." + output_format
+
+def create_output_file(filename, output_format="vm"):
+        # VMWriter creates the file itself once the whole class is compiled
+        outputFileName = get_output_file_name(filename, output_format)
         print("OUTPUT: {}\n".format(outputFileName))
         print("")
-        outputFile = open(outputFileName, 'a+')
-        return outputFile
+        return outputFileName
 
 def is_jack_file(fileName):
     return os.path.basename(fileName).partition(".")[2] == "jack"
 
-def get_list_of_files():
-    try:
-        input_name = sys.argv[1]
-    except IndexError:
-        raise SystemExit("Usage: {} <input filename/directory>".format(sys.argv[0]))
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument("input", nargs="?", help="input filename/directory")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of files to compile in parallel")
+    parser.add_argument("--cache-dir",
+                        help="directory for the incremental build cache")
+    parser.add_argument("--cache-size", type=int, default=64 * 1024 * 1024,
+                        help="maximum size of the build cache in bytes")
+    parser.add_argument("--format", choices=["vm", "vmb", "asm"], default="vm",
+                        help="text VM code, compact binary VM code or one Hack assembly file (implies --whole-program)")
+    parser.add_argument("-O", "--optimize", action="store_true",
+                        help="run the peephole optimizer over the generated code")
+    parser.add_argument("--pool-strings", action="store_true",
+                        help="build each string literal once at startup and reuse it from a static")
+    parser.add_argument("--whole-program", action="store_true",
+                        help="drop subroutines that cannot be reached from Main.main")
+    parser.add_argument("--inline", action="store_true",
+                        help="inline small subroutines at their call sites (implies --whole-program)")
+    parser.add_argument("--inline-size", type=int, default=12,
+                        help="largest subroutine body, in VM commands, to inline")
+    parser.add_argument("--inline-budget", type=int, default=2000,
+                        help="maximum number of VM commands inlining may add")
+    parser.add_argument("--compact-tokens", action="store_true",
+                        help="store tokens in packed arrays to reduce memory on huge sources")
+    parser.add_argument("--mmap", action="store_true",
+                        help="memory-map sources and tokenize the bytes in place (implies --compact-tokens)")
+    parser.add_argument("--profile", nargs="?", const="profile.json",
+                        help="time each compilation phase per file and write a JSON report (default profile.json)")
+    parser.add_argument("--profile-top", type=int, default=5,
+                        help="number of slowest files listed by --profile")
+    parser.add_argument("--cprofile",
+                        help="directory for per-file cProfile stats of the profiled phases (implies --profile)")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and recompile files as they change")
+    parser.add_argument("--watch-interval", type=float, default=0.5,
+                        help="seconds between polls of the input in --watch mode")
+    parser.add_argument("--debounce", type=float, default=0.2,
+                        help="seconds without further changes before a --watch rebuild starts")
+    parser.add_argument("--index",
+                        help="file keeping the class signature index between runs; only changed files are rescanned")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="run a compile server on unix:PATH, HOST:PORT or PORT instead of compiling input")
+    parser.add_argument("--serve-root",
+                        help="directory the paths of --serve requests must be inside (default: the current directory)")
+    return parser.parse_args(argv)
 
+def get_list_of_files(input_name):
     is_directory = os.path.isdir(input_name)
     if is_directory:
         list_of_all_files = os.listdir(input_name)
@@ -36,25 +96,295 @@ def strip_file_name(name):
         name = name.split("/")[-1]
     return name.partition(".")[0]
 
+def compile_file(file, class_record, options, intern_table=None):
+    # Returns (error message or None, statistics, commands) for this file;
+    # commands are only kept in memory for whole-program builds. intern_table
+    # is shared by the compact tokenizers of one build.
+    profiler = get_profiler(file, options)
+    tokenizer = None
+    try:
+        if options.whole_program:
+            output_file = None
+        else:
+            output_file = create_output_file(file, options.format)
+        # With the subroutine cache only subroutines that changed are tokenized
+        deferred = subroutine_cache is not None
+        if options.mmap:
+            tokenizer = MappedTokenizer(file, intern_table, profiler, deferred=deferred)
+        elif options.compact_tokens:
+            tokenizer = CompactTokenizer(file, intern_table, profiler, deferred=deferred)
+        else:
+            tokenizer = JackTokenizer(file, profiler, deferred=deferred)
+        engine = CompilationEngine(tokenizer, output_file, class_record, options.optimize, options.pool_strings, profiler,
+                                   subroutine_cache)
+    except Exception as error:
+        statistics = {}
+        if options.profile:
+            statistics = profiler.get_statistics()
+            profiler.dump()
+        return "{}: {}".format(type(error).__name__, error), statistics, None
+    finally:
+        # Unmaps the source of a MappedTokenizer
+        if tokenizer is not None:
+            tokenizer.close()
+
+    statistics = engine.get_statistics()
+    if options.profile:
+        statistics.update(profiler.get_statistics())
+        statistics["profile.tokens"] = tokenizer.token_count()
+        statistics["profile.labels"] = sum(1 for command in engine.writer.commands if command[0] == "label")
+        profiler.dump()
+    if options.whole_program:
+        return None, statistics, engine.writer.commands
+    return None, statistics, None
+
+def get_signature_index(file_names, index_name=None):
+    # Pre-scans the header of every file; with index_name, signatures of
+    # unchanged files are taken from the previous run
+    previous = SignatureIndex.load(index_name) if index_name else None
+    index = SignatureIndex()
+    for file in file_names:
+        index.scan_file(file, strip_file_name(file), previous)
+    if index_name:
+        index.save(index_name)
+    return index
+
+def declared_class_name(text):
+    # Name following the first class keyword, skipping comments
+    previous = None
+    for symbol, word, integer, string, error in token_pattern.findall(text):
+        if previous == "class" and word:
+            return word
+        previous = word or symbol or integer or string or error
+    return None
+
+def compile_source(text, class_names=(), optimize=False, pool_strings=False, output_name=None, index=None):
+    # Compiles one class from a string and returns the VM code as text.
+    # class_names lists the other classes of the program; the class itself
+    # is added automatically. index is a SignatureIndex of the program, built
+    # from class_names and this class's header when not given. Nothing
+    # touches the disk unless output_name is given, in which case the code
+    # is also written there.
+    if index is None:
+        index = SignatureIndex()
+        for class_name in class_names:
+            index.add_name(class_name)
+        class_name = declared_class_name(text)
+        if class_name:
+            index.scan(class_name, text)
+    tokenizer = JackTokenizer(None, source=text, deferred=subroutine_cache is not None)
+    engine = CompilationEngine(tokenizer, output_name, index, optimize, pool_strings, subroutine_cache=subroutine_cache)
+    return engine.writer.get_output()
+
+def compile_sources(sources, class_names=(), optimize=False, pool_strings=False):
+    # Compiles a {class name: source} mapping and returns {class name: VM text}
+    index = get_source_index(sources, class_names)
+    outputs = {}
+    for name, text in sources.items():
+        try:
+            outputs[name] = compile_source(text, optimize=optimize, pool_strings=pool_strings, index=index)
+        except Exception as error:
+            raise Exception("{}: {}".format(name, error)) from error
+    return outputs
+
+def get_source_index(sources, class_names=()):
+    index = SignatureIndex()
+    for class_name in class_names:
+        index.add_name(class_name)
+    for name, text in sources.items():
+        index.scan(name, text)
+    return index
+
+def enable_subroutine_cache(filename=None):
+    # Later compiles in this process only parse subroutines that changed;
+    # with filename the cache starts from the one saved there
+    global subroutine_cache
+    if subroutine_cache is None:
+        subroutine_cache = SubroutineCache.load(filename) if filename else SubroutineCache()
+    return subroutine_cache
+
+def get_subroutine_cache_name(cache_dir):
+    return os.path.join(cache_dir, "subroutines.json")
+
+def get_profiler(file, options):
+    if not options.profile:
+        return PhaseProfiler.null_profiler
+    profile_name = None
+    if options.cprofile:
+        profile_name = os.path.join(options.cprofile, strip_file_name(file) + ".prof")
+    return PhaseProfiler.PhaseProfiler(profile_name)
+
+def compile_files(file_names, class_record, options):
+    if options.jobs > 1 and len(file_names) > 1:
+        with ProcessPoolExecutor(max_workers=options.jobs) as pool:
+            total = len(file_names)
+            results = pool.map(compile_file, file_names, [class_record] * total, [options] * total)
+            return list(zip(file_names, results))
+
+    # Dropped with the build, so --watch does not keep old identifiers
+    intern_table = InternTable()
+    results = list()
+    for file in file_names:
+        print("COMPILING...")
+        print("INPUT: ", file)
+        results.append((file, compile_file(file, class_record, options, intern_table)))
+    return results
+
+def get_build_options(options):
+    # Options that change the generated code, for the build cache key
+    return "O{}P{}".format(options.optimize, options.pool_strings)
+
+def format_string_pool_report(statistics):
+    return "STRINGS: {} literals pooled into {} statics, {} calls removed from literal uses, {} calls added at startup".format(
+        statistics.get("strings.literals", 0), statistics.get("strings.pooled", 0),
+        statistics.get("strings.calls_eliminated", 0), statistics.get("strings.startup_calls", 0))
+
+def format_subroutine_cache_report(statistics):
+    return "SUBROUTINES: {} compiled, {} reused from the subroutine cache".format(
+        statistics.get("subroutines.compiled", 0), statistics.get("subroutines.reused", 0))
+
+def merge_statistics(results):
+    totals = {}
+    for file, (error, statistics, commands) in results:
+        for name, count in statistics.items():
+            totals[name] = totals.get(name, 0) + count
+    return totals
+
+def link_program(results, options):
+    # Whole-program passes run once every file has been compiled
+    program = VMProgram()
+    for file, (error, statistics, commands) in results:
+        program.add_unit(file, commands)
+
+    if options.inline:
+        inliner = Inliner(options.inline_size, options.inline_budget)
+        inliner.inline(program)
+        print(inliner.report())
+
+    eliminator = DeadCodeEliminator()
+    if eliminator.eliminate(program):
+        print(eliminator.report())
+    else:
+        print("No Main.main found; keeping every subroutine.")
+
+    if options.format == "asm":
+        write_assembly(program, get_assembly_file_name(options.input))
+        return
+    for file in program.units:
+        writer = VMWriter(create_output_file(file, options.format))
+        writer.extend(program.get_commands(file))
+        writer.close()
+
+def get_assembly_file_name(input_name):
+    # A Hack program is a single file, named after the input directory or file
+    input_name = os.path.normpath(input_name)
+    if os.path.isdir(input_name):
+        return os.path.join(input_name, os.path.basename(os.path.abspath(input_name)) + ".asm")
+    return os.path.splitext(input_name)[0] + ".asm"
+
+def write_assembly(program, output_name):
+    print("OUTPUT: {}\n".format(output_name))
+    units = [(strip_file_name(file), program.get_commands(file)) for file in program.units]
+    writer = HackWriter(output_name)
+    writer.write_program(units)
+    writer.close()
+    # The textbook expansion of the same program, for comparison
+    naive = NaiveHackWriter()
+    naive.write_program(units)
+    print(format_assembly_report(writer, naive))
+
+def format_assembly_report(writer, naive):
+    statistics = writer.statistics
+    return ("ASM: {} instructions in ROM, {} with the naive expansion ({:+.0%}); {} calls through {} shared "
+            "trampolines, {} stack tops kept in D, {} command pairs fused").format(
+        writer.rom_size(), naive.rom_size(), writer.rom_size() / naive.rom_size() - 1, statistics["asm.calls"],
+        len(writer.call_arities) + 1, statistics["asm.cached"], statistics["asm.fused"])
+
 def main():
-    unprocessed_file_names = get_list_of_files()
+    arguments = parse_arguments()
+    if arguments.jobs < 1:
+        raise SystemExit("--jobs must be at least 1")
+    if arguments.serve:
+        import CompileServer
+        CompileServer.serve(arguments.serve, arguments.jobs, arguments.cache_size, arguments.serve_root)
+        return
+    if arguments.input is None:
+        raise SystemExit("An input file or directory is required unless --serve is used")
+    if arguments.inline or arguments.format == "asm":
+        arguments.whole_program = True
+    if arguments.cprofile:
+        os.makedirs(arguments.cprofile, exist_ok=True)
+        arguments.profile = arguments.profile or "profile.json"
+    if arguments.watch:
+        if arguments.cache_dir or arguments.profile:
+            print("--cache-dir and --profile are not used in --watch mode.")
+            arguments.profile = None
+        import Watcher
+        Watcher.Watcher(arguments.input, arguments, arguments.watch_interval, arguments.debounce).run()
+        return
+    start = time.perf_counter()
+
+    unprocessed_file_names = get_list_of_files(arguments.input)
     processed_file_names = list()
-    class_record = ClassRecord()
 
     for file in unprocessed_file_names:
         class_name = strip_file_name(file)
         print("ADDING {} TO LIST OF CLASSES...\n".format(class_name))
-        class_record.add_name(class_name)
         processed_file_names.append(file)
+    class_record = get_signature_index(processed_file_names, arguments.index)
+    if arguments.index:
+        print(class_record.report())
 
-    for file in processed_file_names:
-        print("COMPILING...")
-        print("INPUT: ", file)
-        output_file = create_output_file(file)
-        tokenizer = JackTokenizer(file, class_record)
-        CompilationEngine(tokenizer, output_file, class_record)
+    cache = None
+    if arguments.cache_dir and arguments.whole_program:
+        print("The build cache is not used for whole-program builds.")
+    elif arguments.cache_dir:
+        cache = BuildCache(arguments.cache_dir, arguments.cache_size)
+        stale_file_names = list()
+        for file in processed_file_names:
+            output_name = get_output_file_name(file, arguments.format)
+            if cache.restore(file, output_name, class_record, get_build_options(arguments)):
+                print("UP TO DATE: ", file)
+            else:
+                stale_file_names.append(file)
+        processed_file_names = stale_file_names
+        if stale_file_names:
+            enable_subroutine_cache(get_subroutine_cache_name(arguments.cache_dir))
+
+    results = compile_files(processed_file_names, class_record, arguments)
+
+    if cache:
+        for file, (error, statistics, commands) in results:
+            if error is None:
+                cache.store(file, get_output_file_name(file, arguments.format))
+        cache.save()
+        # Workers of a parallel build fill their own copies, which are not saved
+        if subroutine_cache is not None:
+            subroutine_cache.save(get_subroutine_cache_name(arguments.cache_dir))
+        print(cache.report())
+
+    if arguments.profile:
+        report = PhaseProfiler.build_report(results, time.perf_counter() - start)
+        PhaseProfiler.write_report(report, arguments.profile)
+        print(PhaseProfiler.format_report(report, arguments.profile_top))
+
+    statistics = merge_statistics(results)
+    if arguments.optimize:
+        print(format_peephole_report(statistics))
+    if arguments.pool_strings:
+        print(format_string_pool_report(statistics))
+    if subroutine_cache is not None:
+        print(format_subroutine_cache_report(statistics))
+
+    failures = [(file, result[0]) for file, result in results if result[0] is not None]
+    for file, error in failures:
+        print("ERROR IN {}: {}".format(file, error))
 
+    if failures:
+        raise SystemExit("Compilation failed for {} of {} files.".format(len(failures), len(results)))
+    if arguments.whole_program:
+        link_program(results, arguments)
     print("Compilation Finished!\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
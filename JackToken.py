@@ -1,13 +1,20 @@
+# Token categories
+KEYWORD, SYMBOL, INTEGER_CONSTANT, STRING_CONSTANT, IDENTIFIER = range(5)
+TOKEN_TYPES = ("keyword", "symbol", "integerConstant", "stringConstant", "identifier")
+
 class JackToken:
-    def __init__(self, token, token_type):
+    __slots__ = ("token", "type", "offset")
+
+    def __init__(self, token, token_type, offset=0):
         self.token = token
         self.type = token_type
-    
+        self.offset = offset
+
     def get_token(self):
         return self.token
-    
+
     def get_token_type(self):
         return self.type
-    
+
     def set_token_type(self, token_type):
-        self.type = token_type
\ No newline at end of file
+        self.type = token_type
@@ -1,201 +1,181 @@
+import re
 from JackToken import *
-from SymbolTable import SymbolTable
+from PhaseProfiler import null_profiler
+
+# Each match swallows the whitespace and comments in front of one token
+token_pattern = re.compile(r"""
+    [ \t\r\n]*(?:/(?:/[^\n]*|\*.*?\*/)[ \t\r\n]*)*
+    (?:
+        ([{}()\[\].,;+\-*&|<>=~]|/(?![/*]))  # symbol
+      | ([A-Za-z_][A-Za-z0-9_]*)              # keyword or identifier
+      | ([0-9]+)                              # integerConstant
+      | ("[^"\n]*")                           # stringConstant
+      | (.)                                   # anything else is an error
+      | \Z
+    )
+""", re.DOTALL | re.VERBOSE)
+
+# Inside a subroutine body only braces matter: long runs of other text,
+# strings and comments are skipped whole
+body_pattern = re.compile(r"""([^{}"/]+)|("[^"\n]*")|(//[^\n]*)|(/\*.*?\*/)|(\{)|(\})|(.)""", re.DOTALL)
+
+def skip_body(text, position, body_pattern=body_pattern):
+    # Position just after the } closing the body whose { ends at position
+    depth = 1
+    for match in body_pattern.finditer(text, position):
+        if match.lastindex == 5:
+            depth += 1
+        elif match.lastindex == 6:
+            depth -= 1
+            if depth == 0:
+                return match.end()
+    return len(text)
+
+def read_declarations(text, token_pattern=token_pattern, body_pattern=body_pattern):
+    # Yields (tokens, start, end) for each class header, class variable and
+    # subroutine declaration in text without tokenizing subroutine bodies.
+    # A subroutine runs from its first token through the } closing its body
+    # and its tokens stop at the {. Works on str, or bytes with byte patterns.
+    open_brace, close_brace, semicolon = ("{", "}", ";") if isinstance(text, str) else (b"{", b"}", b";")
+    depth = 0
+    declaration = []
+    start = position = 0
+    while position < len(text):
+        match = token_pattern.match(text, position)
+        if match.end() == position:
+            break
+        position = match.end()
+        group = match.lastindex
+        if group is None or group == 5:
+            continue
+        token = match.group(group)
+        if not declaration:
+            start = match.start(group)
+        if token == open_brace and group == 1:
+            declaration.append(token)
+            if depth == 1:
+                position = skip_body(text, position, body_pattern)
+            else:
+                depth += 1
+            yield declaration, start, position
+            declaration = []
+        elif token == close_brace and group == 1:
+            depth -= 1
+            declaration = []
+        elif token == semicolon and group == 1 and depth == 1:
+            yield declaration, start, position
+            declaration = []
+        else:
+            declaration.append(token)
 
 class JackTokenizer:
-    def __init__(self, filename, class_record):
-        self.symbols = frozenset(['{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', 
-                                 '*', '/', '&', '|', '<', '>', '=', '~'])
-        self.keywords = frozenset(['class', 'constructor', 'function', 'method', 'field', 'static',
-                                  'var', 'int', 'char', 'boolean', 'void', 'true', 'false',
-                                  'null', 'this', 'let', 'do', 'if', 'else', 'while', 'return'])
-        self.integers = '1234567890'
-        self.jack_standard_library = ['Math', 'String', 'Array', 'Output', 'Screen', 'Keyboard', 'Memory', 'Sys']
-        self.class_record = class_record
-        
+    # Shared by every tokenizer instead of being rebuilt per file
+    symbols = frozenset(['{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-',
+                         '*', '/', '&', '|', '<', '>', '=', '~'])
+    keywords = frozenset(['class', 'constructor', 'function', 'method', 'field', 'static',
+                          'var', 'int', 'char', 'boolean', 'void', 'true', 'false',
+                          'null', 'this', 'let', 'do', 'if', 'else', 'while', 'return'])
+    integers = '1234567890'
+
+    subroutine_keywords = ("constructor", "function", "method", b"constructor", b"function", b"method")
+
+    def __init__(self, filename, profiler=null_profiler, source=None, deferred=False):
+        # With source the text is tokenized directly and filename is not read.
+        # Identifiers are resolved by CompilationEngine while it parses.
+        # With deferred only the text outside subroutines is tokenized up
+        # front; see block_source.
+        self.profiler = profiler
+        self.deferred = deferred
+        self.source = None
+        # (start, end of first token, end) of each subroutine and the next one not loaded
+        self.blocks = []
+        self.next_block = 0
+
         self.tokens = list()
-        self.symbol_table = SymbolTable()
-        self.tokenize_stream(filename)
-        self.add_extended_identifiers()
+        if source is None:
+            self.tokenize_stream(filename)
+        else:
+            self.tokenize_text(source)
         self.current_index = 0
 
     def tokenize_stream(self, file):
-        with open(file) as f:
-           all_lines = list(f)
-           clean_lines = self.remove_single_line_comments(all_lines)
-           parsed_lines = self.parse_lines(clean_lines)
-           self.parse_tokens(parsed_lines)
-
-    def remove_single_line_comments(self, f):
-        all_lines = list(f)
-        clean_lines = list()
-        for line in all_lines:
-            no_newline = line.strip()
-            no_single_line_comments = no_newline.partition("//")[0]
-            filtered_lines = filter(lambda x: x != '', no_single_line_comments)
-            clean_lines += filtered_lines
-        return clean_lines
-
-    def parse_lines(self, lines):
-        raw_tokens = list()
-        current_stream = ""
-        multiline_comment = False
-        string_const = False
-
-        for index, char in enumerate(lines):
-            if char == "/" and len(lines) > index + 2 and lines[index+1] == "*" and lines[index+2 == "*"]:
-                multiline_comment = True
-            elif char == "/" and index > 0 and lines[index-1] == "*":
-                multiline_comment = False
-            elif not multiline_comment:
-                if char in self.symbols and not string_const:
-                    if current_stream != "":
-                        raw_tokens.append(current_stream)
-                    raw_tokens.append(char)
-                    current_stream = ""
-                elif char == " " and not string_const:
-                    if current_stream != "":
-                        raw_tokens.append(current_stream)
-                    current_stream = ""
-                elif char == "\"" and not string_const:
-                    string_const = True
-                    current_stream += char
-                elif char == "\"" and string_const:
-                    string_const = False
-                    current_stream += char
-                else:
-                    current_stream += char
-
-        if current_stream != "":
-            raw_tokens.append(current_stream)
-        return raw_tokens
-
-    def parse_tokens(self, tokens):
-        for token in tokens:
-            if len(token) == 1:
-                if token in self.symbols:
-                    current_token = JackToken(token, "symbol")
-                    self.tokens.append(current_token)
-                elif token in self.integers:
-                    current_token = JackToken(token, "integerConstant")
-                    self.tokens.append(current_token)
-                else:
-                    current_token = JackToken(token, "identifier")
-                    self.tokens.append(current_token)
-            else:
-                if token in self.keywords:
-                    current_token = JackToken(token, "keyword")
-                    self.tokens.append(current_token)
-                elif token[0] == "\"":
-                    current_token = JackToken(token, "stringConstant")
-                    self.tokens.append(current_token)
-                elif token[0] in self.integers:
-                    current_token = JackToken(token, "integerConstant")
-                    self.tokens.append(current_token)
-                else:
-                    current_token = JackToken(token, "identifier")
-                    self.tokens.append(current_token)
-        return self.tokens
-
-    def add_extended_identifiers(self):
-        for current_index in range(0, len(self.tokens)):
-            current_token = self.tokens[current_index]
-            token_name = current_token.get_token()
-            token_type = current_token.get_token_type()
-
-            if token_name == "constructor":
-                total_fields = self.symbol_table.var_count("field")
-                current_token.set_token_type("keyword.{}".format(total_fields))
-
-            if token_type == "identifier":
-                type_index = current_index - 1
-                kind_index = current_index - 2
-
-                if type_index >= 0:
-                    type_token = self.tokens[type_index].get_token()
-                else:
-                    type_token = None
+        self.tokenize_text(self.profiler.measure("io", self.read_source, file))
 
-                if kind_index >= 0:
-                   kind_token = self.tokens[kind_index].get_token()
-                else:
-                    kind_token = None
-
-                def add_to_symbol_table(kind):
-                    identifier_type = type_token
-                    self.symbol_table.define(token_name, identifier_type, kind)
-
-                # Check if in symbol table
-                if self.symbol_table.get_symbol(token_name):
-                    running_index = self.symbol_table.index_of(token_name)
-                    token_kind = self.symbol_table.kind_of(token_name)
-                    token_type = self.symbol_table.type_of(token_name)
-                    current_token.set_token_type("identifier.{}.used.true.{}.{}".format(token_kind, running_index, token_type))
-                # Class
-                elif type_token == "class":
-                    self.symbol_table.set_class_name(token_name)
-                    current_token.set_token_type("identifier.class.defined.false.0")
-                # Subroutine
-                elif kind_token in ["constructor", "function", "method"]:
-                    self.symbol_table.start_subroutine()
-                    if kind_token == "method":
-                        self.symbol_table.define("this", self.symbol_table.get_class(), "argument")
-                    current_token.set_token_type("identifier.subroutine.defined.false.0")
-                # Arg
-                elif kind_token in ["(", ","]:
-                    add_to_symbol_table("argument")
-                    running_index = self.symbol_table.var_count("argument")
-                    current_token.set_token_type("identifier.argument.used.true.{}".format(running_index))
-                # Var
-                elif kind_token == "var":
-                    add_to_symbol_table("var")
-                    running_index = self.symbol_table.var_count("var")
-                    current_token.set_token_type("identifier.var.defined.true.{}".format(running_index))
-                # Static
-                elif kind_token == "static":
-                    add_to_symbol_table("static")
-                    running_index = self.symbol_table.var_count("static")
-                    current_token.set_token_type("identifier.static.defined.true.{}".format(running_index))
-                # Field
-                elif kind_token == "field":
-                    add_to_symbol_table("field")
-                    running_index = self.symbol_table.var_count("field")
-                    current_token.set_token_type("identifier.field.defined.true.{}".format(running_index))
-                # Do Statement
-                elif type_token == "do":
-                    current_token.set_token_type("identifier.subroutine.used.false.0")
-                # Identifier in list
-                # Var declarations like var int i, j, k
-                # Parameter lists like (x, y)
-                elif type_token == ",":
-                    kind_token = None
-                    temp_index = type_index
-                    while (not kind_token) and (temp_index > 0):
-                        temp_index = temp_index - 1
-                        temp_token = self.tokens[temp_index].get_token()
-                        if temp_token in ["field", "static", "var"]:
-                            self.symbol_table.define(token_name, self.tokens[temp_index + 1].get_token(), temp_token)
-                            running_index = self.symbol_table.var_count(temp_token)
-                            current_token.set_token_type("identifier.{}.defined.true.{}".format(temp_token, running_index))
-                            break
-                        elif temp_token == "(":
-                            running_index = self.symbol_table.index_of(token_name)
-                            token_type = self.symbol_table.kind_of(token_name)
-                            current_token.set_token_type("identifier.{}.used.true.{}".format(token_type, running_index))
-                            break
-                # Abstract data types
-                elif type_token in ["field", "static", "var"]:
-                    current_token.set_token_type("identifier.class.used.false.0")
-                # Identifier is the class itself
-                elif self.class_record.exists(token_name):
-                    current_token.set_token_type("identifier.class.used.0")
-                # Jack Standard Library
-                elif token_name in self.jack_standard_library:
-                    current_token.set_token_type("identifier.class.used.false.0")
-                # Method calls
-                elif type_token == ".":
-                    current_token.set_token_type("identifier.subroutine.used.false.0")
+    def tokenize_text(self, text):
+        if self.deferred:
+            self.profiler.measure("tokenize", self.defer_subroutines, text)
+        else:
+            self.tokens = self.profiler.measure("tokenize", list, self.generate_tokens(text))
+
+    def append_tokens(self, text, start, end):
+        self.tokens.extend(self.generate_tokens(text, start, end))
+
+    def defer_subroutines(self, text, patterns=(token_pattern, body_pattern)):
+        self.source = text
+        for tokens, start, end in read_declarations(text, *patterns):
+            if tokens[0] in JackTokenizer.subroutine_keywords:
+                self.blocks.append((start, start + len(tokens[0]), end))
+        self.load_until_block(0)
+
+    def load_until_block(self, position):
+        # Tokens from position through the first token of the next deferred
+        # subroutine, which is where the parser stops to ask for it
+        if self.next_block < len(self.blocks):
+            self.append_tokens(self.source, position, self.blocks[self.next_block][1])
+        else:
+            self.append_tokens(self.source, position, len(self.source))
+
+    def block_source(self):
+        # Source of the deferred subroutine starting at the current token, or
+        # None when the current token does not start one
+        if self.next_block < len(self.blocks) and self.current_index == self.token_count() - 1:
+            start, first_end, end = self.blocks[self.next_block]
+            return self.source[start:end]
+        return None
+
+    def skip_block(self):
+        # Moves past the subroutine from block_source without tokenizing it
+        start, first_end, end = self.blocks[self.next_block]
+        self.next_block += 1
+        self.profiler.measure("tokenize", self.load_until_block, end)
+        self.advance()
+
+    def load_block(self):
+        # Tokenizes the subroutine from block_source so it can be parsed
+        start, first_end, end = self.blocks[self.next_block]
+        self.next_block += 1
+        self.profiler.measure("tokenize", self.append_tokens, self.source, first_end, end)
+        self.profiler.measure("tokenize", self.load_until_block, end)
+
+    def read_source(self, file):
+        with open(file) as f:
+            return f.read()
+
+    def close(self):
+        # Called once the parser is done with the tokens
+        self.source = None
+
+    def token_count(self):
+        return len(self.tokens)
+
+    def generate_tokens(self, text, start=0, end=None):
+        keywords = self.keywords
+        for symbol, word, integer, string, error in token_pattern.findall(text, start, len(text) if end is None else end):
+            if symbol:
+                yield JackToken(symbol, SYMBOL)
+            elif word:
+                if word in keywords:
+                    yield JackToken(word, KEYWORD)
                 else:
-                    raise Exception("Identifier type {} and kind {} not found for {} {}.".format(type_token, kind_token, token_type, token_name))
+                    yield JackToken(word, IDENTIFIER)
+            elif integer:
+                yield JackToken(integer, INTEGER_CONSTANT)
+            elif string:
+                yield JackToken(string, STRING_CONSTANT)
+            elif error:
+                if error in "\"/":
+                    raise Exception("Unterminated string constant or comment")
+                raise Exception("Unexpected character {!r}".format(error))
 
     def hasMoreTokens(self):
         if self.current_index < len(self.tokens) - 1:
@@ -217,4 +197,6 @@ class JackTokenizer:
         current_token = self.tokens[self.current_index]
         return current_token.get_token()
 
-    
\ No newline at end of file
+    def peek_token(self):
+        return self.tokens[self.current_index + 1].token
+
@@ -0,0 +1,150 @@
+def is_push(command, segment=None):
+    return command[0] == "push" and (segment is None or command[1] == segment)
+
+def is_constant(command, value):
+    return command[0] == "push" and command[1] == "constant" and command[2] == value
+
+def double_not(window):
+    # not; not
+    if window[0] == ("not",) and window[1] == ("not",):
+        return []
+
+def double_neg(window):
+    # neg; neg
+    if window[0] == ("neg",) and window[1] == ("neg",):
+        return []
+
+def add_zero(window):
+    # push constant 0; add|sub
+    if is_constant(window[0], 0) and window[1][0] in ["add", "sub"]:
+        return []
+
+def push_pop_same(window):
+    # push local 2; pop local 2
+    first, second = window
+    if first[0] == "push" and second[0] == "pop" and first[1:] == second[1:] and first[1] != "constant":
+        return []
+
+def not_true(window):
+    # push constant 1; neg; not  ->  push constant 0
+    if is_constant(window[0], 1) and window[1] == ("neg",) and window[2] == ("not",):
+        return [("push", "constant", 0)]
+
+def constant_branch(window):
+    # push constant c; if-goto L  ->  goto L when c is true, nothing when it is false
+    first, second = window
+    if second[0] == "if-goto" and is_push(first, "constant"):
+        if first[2] == 0:
+            return []
+        return [("goto", second[1])]
+
+def true_branch(window):
+    # push constant 1; neg; if-goto L  ->  goto L
+    if is_constant(window[0], 1) and window[1] == ("neg",) and window[2][0] == "if-goto":
+        return [("goto", window[2][1])]
+
+def inverted_if(window):
+    # lt; not; if-goto L1; goto L2; label L1  ->  lt; if-goto L2; label L1
+    # not is bitwise, so it only inverts the branch on a comparison result
+    comparison, first, branch, jump, label = window
+    if (comparison[0] in ["eq", "lt", "gt"] and first == ("not",) and branch[0] == "if-goto"
+            and jump[0] == "goto" and label[0] == "label" and branch[1] == label[1]):
+        return [comparison, ("if-goto", jump[1]), label]
+
+def goto_next(window):
+    # goto L; label L
+    if window[0][0] == "goto" and window[1][0] == "label" and window[0][1] == window[1][1]:
+        return [window[1]]
+
+def unreachable(window):
+    # Code after goto/return is dead until the next label or function
+    first, second = window
+    if first[0] in ["goto", "return"] and second[0] not in ["label", "function"]:
+        return [first]
+
+def array_store(window):
+    # push x; pop temp 0; pop pointer 1; push temp 0; pop that 0
+    #   ->  pop pointer 1; push x; pop that 0
+    value, save, point, restore, store = window
+    if (value[0] == "push" and value[1] not in ["that", "pointer"]
+            and save == ("pop", "temp", 0) and point == ("pop", "pointer", 1)
+            and restore == ("push", "temp", 0) and store == ("pop", "that", 0)):
+        return [point, value, store]
+
+def format_report(statistics):
+    # Summarizes the counters from PeepholeOptimizer.get_statistics()
+    lines = ["PEEPHOLE: {} instructions removed".format(statistics.get("peephole.removed", 0))]
+    for name, count in sorted(statistics.items()):
+        if name.startswith("peephole.") and name != "peephole.removed" and count:
+            lines.append("    {}: {}".format(name.partition(".")[2], count))
+    return "\n".join(lines)
+
+class PeepholeOptimizer:
+    # (name, window size, rule) - a rule returns the replacement or None
+    rules = [
+        ("double_not", 2, double_not),
+        ("double_neg", 2, double_neg),
+        ("add_zero", 2, add_zero),
+        ("push_pop_same", 2, push_pop_same),
+        ("constant_branch", 2, constant_branch),
+        ("goto_next", 2, goto_next),
+        ("unreachable", 2, unreachable),
+        ("not_true", 3, not_true),
+        ("true_branch", 3, true_branch),
+        ("inverted_if", 5, inverted_if),
+        ("array_store", 5, array_store),
+    ]
+
+    def __init__(self):
+        self.hits = {name: 0 for name, size, rule in PeepholeOptimizer.rules}
+        self.hits["unused_label"] = 0
+        self.removed = 0
+
+    def optimize(self, commands):
+        total = len(commands)
+        optimized = self.apply_rules(commands)
+        # Dropping labels nobody jumps to can expose more dead code
+        while True:
+            cleaned = self.remove_unused_labels(optimized)
+            if len(cleaned) == len(optimized):
+                break
+            optimized = self.apply_rules(cleaned)
+        self.removed += total - len(optimized)
+        return optimized
+
+    def apply_rules(self, commands):
+        # Each command is appended to the output and the rules are retried on the
+        # tail of the output until none matches, so rewrites can cascade
+        output = []
+        for command in commands:
+            output.append(command)
+            changed = True
+            while changed:
+                changed = False
+                for name, size, rule in PeepholeOptimizer.rules:
+                    if len(output) < size:
+                        continue
+                    replacement = rule(output[-size:])
+                    if replacement is not None:
+                        del output[-size:]
+                        output.extend(replacement)
+                        self.hits[name] += 1
+                        changed = True
+                        break
+        return output
+
+    def remove_unused_labels(self, commands):
+        used = set([command[1] for command in commands if command[0] in ["goto", "if-goto"]])
+        cleaned = []
+        for command in commands:
+            if command[0] == "label" and command[1] not in used:
+                self.hits["unused_label"] += 1
+            else:
+                cleaned.append(command)
+        return cleaned
+
+    def get_statistics(self):
+        statistics = {"peephole.removed": self.removed}
+        for name, count in self.hits.items():
+            statistics["peephole." + name] = count
+        return statistics
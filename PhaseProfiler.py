@@ -0,0 +1,88 @@
+import json
+import time
+import cProfile
+
+PHASES = ["io", "tokenize", "parse", "write"]
+
+class NullProfiler:
+    # Used when --profile is off: each phase is a plain call
+    def measure(self, phase, function, *args):
+        return function(*args)
+
+null_profiler = NullProfiler()
+
+class PhaseProfiler:
+    def __init__(self, profile_name=None):
+        # With profile_name every phase also runs under cProfile and the
+        # stats are dumped there by dump()
+        self.seconds = {phase: 0.0 for phase in PHASES}
+        self.profile_name = profile_name
+        self.profile = cProfile.Profile() if profile_name else None
+        # Seconds spent in nested phases, one entry per running phase
+        self.nested = []
+
+    def measure(self, phase, function, *args):
+        # Phases nest when the parser tokenizes a deferred subroutine; the
+        # inner phase's time is not counted again in the outer one
+        if self.profile and not self.nested:
+            self.profile.enable()
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.seconds[phase] += elapsed - self.nested.pop()
+            if self.nested:
+                self.nested[-1] += elapsed
+            elif self.profile:
+                self.profile.disable()
+
+    def dump(self):
+        if self.profile:
+            self.profile.dump_stats(self.profile_name)
+
+    def get_statistics(self):
+        return {"profile." + phase: seconds for phase, seconds in self.seconds.items()}
+
+def file_seconds(statistics):
+    return sum(statistics.get("profile." + phase, 0.0) for phase in PHASES)
+
+def build_report(results, wall_seconds):
+    # results are (file, (error, statistics, commands)) as returned by compile_files
+    files = []
+    for file, (error, statistics, commands) in results:
+        entry = {"file": file, "seconds": round(file_seconds(statistics), 6)}
+        for phase in PHASES:
+            entry[phase] = round(statistics.get("profile." + phase, 0.0), 6)
+        for counter in ["tokens", "instructions", "labels"]:
+            entry[counter] = statistics.get("profile." + counter, statistics.get(counter, 0))
+        if error:
+            entry["error"] = error
+        files.append(entry)
+
+    totals = {"seconds": round(sum(entry["seconds"] for entry in files), 6)}
+    for name in PHASES + ["tokens", "instructions", "labels"]:
+        totals[name] = sum(entry[name] for entry in files)
+        if name in PHASES:
+            totals[name] = round(totals[name], 6)
+    return {"wall_seconds": round(wall_seconds, 6), "totals": totals, "files": files}
+
+def write_report(report, filename):
+    with open(filename, "w") as f:
+        json.dump(report, f, indent=2)
+
+def format_report(report, top=5):
+    totals = report["totals"]
+    lines = ["PROFILE: {} files in {:.3f}s wall, {} tokens, {} instructions, {} labels".format(
+        len(report["files"]), report["wall_seconds"], totals["tokens"], totals["instructions"], totals["labels"])]
+    busy = totals["seconds"] or 1
+    lines.append("    " + "  ".join("{} {:.3f}s ({:.0%})".format(phase, totals[phase], totals[phase] / busy)
+                                   for phase in PHASES))
+    slowest = sorted(report["files"], key=lambda entry: -entry["seconds"])[:top]
+    if slowest:
+        lines.append("SLOWEST FILES:")
+    for entry in slowest:
+        phase = max(PHASES, key=lambda name: entry[name])
+        lines.append("    {:.4f}s  {}  (mostly {})".format(entry["seconds"], entry["file"], phase))
+    return "\n".join(lines)
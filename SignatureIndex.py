@@ -0,0 +1,249 @@
+import os
+import json
+import hashlib
+from JackTokenizer import read_declarations
+from VMWriter import write_file
+
+# Headers of the Jack OS classes, read with the same scanner as user code
+OS_HEADERS = [
+    """class Math {
+        function void init() {} function int abs(int x) {} function int multiply(int x, int y) {}
+        function int divide(int x, int y) {} function int min(int x, int y) {} function int max(int x, int y) {}
+        function int sqrt(int x) {}
+    }""",
+    """class String {
+        constructor String new(int maxLength) {} method void dispose() {} method int length() {}
+        method char charAt(int j) {} method void setCharAt(int j, char c) {} method String appendChar(char c) {}
+        method void eraseLastChar() {} method int intValue() {} method void setInt(int val) {}
+        function char backSpace() {} function char doubleQuote() {} function char newLine() {}
+    }""",
+    """class Array {
+        function Array new(int size) {} method void dispose() {}
+    }""",
+    """class Output {
+        function void init() {} function void moveCursor(int i, int j) {} function void printChar(char c) {}
+        function void printString(String s) {} function void printInt(int i) {} function void println() {}
+        function void backSpace() {}
+    }""",
+    """class Screen {
+        function void init() {} function void clearScreen() {} function void setColor(boolean b) {}
+        function void drawPixel(int x, int y) {} function void drawLine(int x1, int y1, int x2, int y2) {}
+        function void drawRectangle(int x1, int y1, int x2, int y2) {} function void drawCircle(int x, int y, int r) {}
+    }""",
+    """class Keyboard {
+        function void init() {} function char keyPressed() {} function char readChar() {}
+        function String readLine(String message) {} function int readInt(String message) {}
+    }""",
+    """class Memory {
+        function void init() {} function int peek(int address) {} function void poke(int address, int value) {}
+        function Array alloc(int size) {} function void deAlloc(Array o) {}
+    }""",
+    """class Sys {
+        function void init() {} function void halt() {} function void error(int errorCode) {}
+        function void wait(int duration) {}
+    }"""
+]
+
+class SubroutineSignature:
+    def __init__(self, kind, return_type, parameter_types):
+        self.kind = kind
+        self.return_type = return_type
+        self.parameter_types = parameter_types
+
+    def arity(self):
+        # Number of arguments pushed by a call, including the object for methods
+        return len(self.parameter_types) + (1 if self.kind == "method" else 0)
+
+    def to_json(self):
+        return [self.kind, self.return_type, self.parameter_types]
+
+    @staticmethod
+    def from_json(data):
+        return SubroutineSignature(data[0], data[1], data[2])
+
+class ClassSignature:
+    def __init__(self, name):
+        self.name = name
+        self.statics = {}
+        self.fields = {}
+        self.subroutines = {}
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "statics": self.statics,
+            "fields": self.fields,
+            "subroutines": {name: signature.to_json() for name, signature in self.subroutines.items()}
+        }
+
+    @staticmethod
+    def from_json(data):
+        signature = ClassSignature(data["name"])
+        signature.statics = data["statics"]
+        signature.fields = data["fields"]
+        signature.subroutines = {name: SubroutineSignature.from_json(subroutine)
+                                 for name, subroutine in data["subroutines"].items()}
+        return signature
+
+def scan_header(text):
+    # Reads the class name, class variables and subroutine signatures without
+    # tokenizing any subroutine body. Never raises: whatever cannot be read
+    # is left out and reported by the real compile.
+    signature = ClassSignature(None)
+    for tokens, start, end in read_declarations(text):
+        if tokens[0] == "class":
+            if signature.name is None and len(tokens) == 3:
+                signature.name = tokens[1]
+        elif tokens[-1] == "{":
+            read_subroutine(signature, tokens[:-1])
+        else:
+            read_class_variables(signature, tokens)
+    return signature
+
+def read_class_variables(signature, declaration):
+    # static|field type name (, name)*
+    if len(declaration) < 3 or declaration[0] not in ["static", "field"]:
+        return
+    table = signature.statics if declaration[0] == "static" else signature.fields
+    for name in declaration[2::2]:
+        table[name] = declaration[1]
+
+def read_subroutine(signature, declaration):
+    # constructor|function|method type name ( (type name (, type name)*)? )
+    if len(declaration) < 5 or declaration[0] not in ["constructor", "function", "method"]:
+        return
+    if declaration[3] != "(" or declaration[-1] != ")":
+        return
+    parameter_types = declaration[4:-1:3]
+    signature.subroutines[declaration[2]] = SubroutineSignature(declaration[0], declaration[1], parameter_types)
+
+OS_SIGNATURES = {}
+for header in OS_HEADERS:
+    os_signature = scan_header(header)
+    OS_SIGNATURES[os_signature.name] = os_signature
+OS_CLASSES = frozenset(OS_SIGNATURES)
+
+# Rough number of VM steps a call runs inside the Jack OS version of a
+# routine, from its function command to its return, on short arguments.
+# Routines not listed take DEFAULT_OS_COST.
+OS_COSTS = {
+    "Math.multiply": 250,
+    "Math.divide": 350,
+    "Math.sqrt": 700,
+    "Memory.alloc": 60,
+    "Memory.deAlloc": 30,
+    "Array.new": 70,
+    "Array.dispose": 40,
+    "String.new": 140,
+    "String.dispose": 40,
+    "String.intValue": 300,
+    "String.setInt": 500,
+    "Output.printChar": 300,
+    "Output.printString": 2000,
+    "Output.printInt": 1500,
+    "Output.println": 40,
+    "Screen.clearScreen": 60000,
+    "Screen.drawPixel": 350,
+    "Screen.drawLine": 5000,
+    "Screen.drawRectangle": 10000,
+    "Screen.drawCircle": 10000,
+    "Keyboard.readLine": 2000,
+    "Keyboard.readInt": 2500
+}
+DEFAULT_OS_COST = 20
+
+def os_cost(name):
+    return OS_COSTS.get(name, DEFAULT_OS_COST)
+
+def os_arity(name):
+    class_name, _, subroutine_name = name.partition(".")
+    return OS_SIGNATURES[class_name].subroutines[subroutine_name].arity()
+
+class SignatureIndex:
+    # Project-wide table of class signatures, keyed by class name. Classes
+    # added with add_name only have a name; the Jack OS is always known.
+    version = 1
+
+    def __init__(self):
+        self.classes = {}
+        # file -> ([mtime_ns, size], class name), to rescan only changed files
+        self.files = {}
+        self.rescanned = 0
+        self.fingerprint_digest = None
+
+    def add_name(self, name):
+        self.classes.setdefault(name, None)
+        self.fingerprint_digest = None
+
+    def add_class(self, name, signature):
+        self.classes[name] = signature
+        self.fingerprint_digest = None
+
+    def exists(self, name):
+        return name in self.classes or name in OS_SIGNATURES
+
+    def get_class(self, name):
+        # Project classes shadow OS classes of the same name
+        if name in self.classes:
+            return self.classes[name]
+        return OS_SIGNATURES.get(name)
+
+    def get_subroutine(self, class_name, subroutine_name):
+        signature = self.get_class(class_name)
+        if signature is None:
+            return None
+        return signature.subroutines.get(subroutine_name)
+
+    def scan(self, name, text):
+        self.add_class(name, scan_header(text))
+
+    def scan_file(self, file, name, previous=None):
+        # Reuses the signature from previous when the file has not changed
+        stat = os.stat(file)
+        stat_key = [stat.st_mtime_ns, stat.st_size]
+        if previous is not None and file in previous.files:
+            previous_key, previous_name = previous.files[file]
+            if previous_key == stat_key and previous_name == name and previous.classes.get(name) is not None:
+                self.files[file] = (stat_key, name)
+                self.add_class(name, previous.classes[name])
+                return
+        with open(file) as f:
+            self.scan(name, f.read())
+        self.files[file] = (stat_key, name)
+        self.rescanned += 1
+
+    def fingerprint(self):
+        # Changes whenever any class or signature changes, for cache keys
+        if self.fingerprint_digest is None:
+            classes = {name: signature.to_json() if signature else None for name, signature in self.classes.items()}
+            self.fingerprint_digest = hashlib.sha256(json.dumps(classes, sort_keys=True).encode()).hexdigest()
+        return self.fingerprint_digest
+
+    def save(self, filename):
+        data = {
+            "version": SignatureIndex.version,
+            "classes": {name: signature.to_json() if signature else None for name, signature in self.classes.items()},
+            "files": self.files
+        }
+        write_file(filename, json.dumps(data, sort_keys=True).encode())
+
+    @staticmethod
+    def load(filename):
+        # An unreadable or outdated file gives an empty index
+        index = SignatureIndex()
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") != SignatureIndex.version:
+            return index
+        for name, signature in data["classes"].items():
+            index.add_class(name, ClassSignature.from_json(signature) if signature else None)
+        index.files = {file: (stat_key, name) for file, (stat_key, name) in data["files"].items()}
+        return index
+
+    def report(self):
+        subroutines = sum(len(signature.subroutines) for signature in self.classes.values() if signature)
+        return "INDEX: {} classes, {} subroutines, {} files scanned".format(
+            len(self.classes), subroutines, self.rescanned)
@@ -0,0 +1,63 @@
+# Cheaper replacements for Math.multiply/Math.divide when one operand is a constant.
+# The other operand is already on the stack; temp 1 and temp 2 are scratch.
+from SignatureIndex import os_cost
+
+# Estimated VM steps of a call to the OS routine: pushing the constant, the
+# call command and the Jack OS routine itself, as VMEmulator charges it
+CALL_COSTS = {
+    "*": 2 + os_cost("Math.multiply"),
+    "/": 2 + os_cost("Math.divide")
+}
+# Expansions longer than this are not worth the code size, however cheap
+MAX_EXPANSION = 40
+
+def executed_steps(sequence):
+    # The expansions are straight-line code, so each command runs once
+    return len(sequence)
+
+def multiply_sequence(constant):
+    if constant == 0:
+        # The other operand may have side effects, so it is still evaluated
+        return [("pop", "temp", 1), ("push", "constant", 0)]
+    if constant == -0x8000:
+        return None
+
+    sequence = []
+    bits = bin(abs(constant))[3:] # Skip the leading one bit
+    if bits:
+        sequence += [("pop", "temp", 1), ("push", "temp", 1)]
+    first_double = True
+    for bit in bits:
+        if first_double:
+            # The running product is still x, which temp 1 holds
+            sequence += [("push", "temp", 1), ("add",)]
+            first_double = False
+        else:
+            sequence += [("pop", "temp", 2), ("push", "temp", 2), ("push", "temp", 2), ("add",)]
+        if bit == "1":
+            sequence += [("push", "temp", 1), ("add",)]
+    if constant < 0:
+        sequence.append(("neg",))
+    return sequence
+
+def divide_sequence(constant):
+    if constant == 1:
+        return []
+    if constant == -1:
+        return [("neg",)]
+    return None
+
+def reduce(op, constant, call_costs=CALL_COSTS):
+    # Returns the replacement commands, or None when the OS call is cheaper
+    # or the expansion too long. call_costs can describe a faster OS.
+    if op == "*":
+        sequence = multiply_sequence(constant)
+    elif op == "/":
+        sequence = divide_sequence(constant)
+    else:
+        return None
+    if sequence is None or len(sequence) > MAX_EXPANSION:
+        return None
+    if executed_steps(sequence) >= call_costs[op]:
+        return None
+    return sequence
@@ -0,0 +1,73 @@
+import json
+import hashlib
+from collections import OrderedDict
+from VMWriter import write_file, format_commands, parse_commands
+
+class SubroutineCache:
+    # Compiled VM commands of single subroutines, keyed by a digest of the
+    # subroutine's source and of everything outside it that its code depends
+    # on. An entry is (commands, pooled strings added, string statistics,
+    # (negative_term, is_constructor) after the subroutine). Commands are
+    # kept as VM text for saving as well; entries read from disk are only
+    # parsed when they are used.
+    version = 1
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # key -> VM text of the commands
+        self.texts = {}
+        self.changed = False
+
+    @staticmethod
+    def key(source, context):
+        digest = hashlib.sha256(source.encode())
+        digest.update(b"\1")
+        digest.update(json.dumps(context, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is None:
+            entry = (parse_commands(self.texts[key]),) + entry[1:]
+            self.entries[key] = entry
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry, text=None):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.texts[key] = text
+        self.changed = True
+        while len(self.entries) > self.max_entries:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            del self.texts[evicted_key]
+
+    def save(self, filename):
+        if not self.changed:
+            return
+        entries = []
+        for key, entry in self.entries.items():
+            if self.texts[key] is None:
+                self.texts[key] = format_commands(entry[0])
+            entries.append((key, (self.texts[key],) + entry[1:]))
+        write_file(filename, json.dumps({"version": SubroutineCache.version, "entries": entries}).encode())
+        self.changed = False
+
+    @staticmethod
+    def load(filename, max_entries=100000):
+        # An unreadable or outdated file gives an empty cache
+        cache = SubroutineCache(max_entries)
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return cache
+        if data.get("version") != SubroutineCache.version:
+            return cache
+        for key, (commands, strings, statistics, state) in data["entries"]:
+            cache.put(key, (None, strings, statistics, tuple(state)), commands)
+        cache.changed = False
+        return cache
@@ -1,5 +1,13 @@
 from Symbol import Symbol
 
+# VM segment holding the variables of each kind
+SEGMENTS = {
+    "static": "static",
+    "field": "this",
+    "argument": "argument",
+    "var": "local"
+}
+
 class SymbolTable:
     def __init__(self):
         self.count = {
@@ -61,12 +69,11 @@ class SymbolTable:
         return self.count[kind] + 1
 
     def get_symbol(self, name):
-        if name in self.class_scope.keys():
-            return self.class_scope[name]
-        elif name in self.subroutine_scope.keys():
-            return self.subroutine_scope[name]
-        else:
-            return None
+        # Subroutine variables shadow class variables
+        symbol = self.subroutine_scope.get(name)
+        if symbol is None:
+            symbol = self.class_scope.get(name)
+        return symbol
 
     def get_class_symbol(self, name):
         if name in self.class_scope.keys():
@@ -84,3 +91,6 @@ class SymbolTable:
 
     def index_of(self, name):
         return self.get_symbol(name).get_index()
+
+    def segment_of(self, name):
+        return SEGMENTS[self.get_symbol(name).get_kind()]
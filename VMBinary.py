@@ -0,0 +1,151 @@
+import sys
+import VMWriter
+
+# Binary .vmb layout:
+#   magic, varint string count, strings (varint length + utf-8 bytes),
+#   varint command count, commands (one-byte opcode + varint operands)
+MAGIC = b"VMB1"
+
+ARITHMETIC = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
+SEGMENTS = ["constant", "argument", "local", "static", "this", "that", "pointer", "temp"]
+
+PUSH = 0x10 # + segment code
+POP = 0x20 # + segment code
+LABEL = 0x30
+GOTO = 0x31
+IF_GOTO = 0x32
+CALL = 0x33
+FUNCTION = 0x34
+RETURN = 0x35
+
+ARITHMETIC_CODES = {command: code for code, command in enumerate(ARITHMETIC)}
+SEGMENT_CODES = {segment: code for code, segment in enumerate(SEGMENTS)}
+LABEL_CODES = {"label": LABEL, "goto": GOTO, "if-goto": IF_GOTO}
+LABEL_COMMANDS = {code: command for command, code in LABEL_CODES.items()}
+
+def write_varint(output, value):
+    if value < 0:
+        raise Exception("Negative operand {} cannot be encoded.".format(value))
+    while value > 0x7f:
+        output.append((value & 0x7f) | 0x80)
+        value >>= 7
+    output.append(value)
+
+def check_length(data, position, length):
+    if position + length > len(data):
+        raise Exception("Truncated binary VM file at offset {}.".format(position))
+
+def read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        check_length(data, position, 1)
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def read_string_id(data, position, strings):
+    string_id, next_position = read_varint(data, position)
+    if string_id >= len(strings):
+        raise Exception("Unknown string {} at offset {}.".format(string_id, position))
+    return strings[string_id], next_position
+
+def encode(commands):
+    strings = {}
+    body = bytearray()
+
+    def string_id(name):
+        if name not in strings:
+            strings[name] = len(strings)
+        return strings[name]
+
+    for command in commands:
+        name = command[0]
+        if name in ARITHMETIC_CODES:
+            body.append(ARITHMETIC_CODES[name])
+        elif name == "push" or name == "pop":
+            segment = SEGMENT_CODES.get(command[1])
+            if segment is None:
+                raise Exception("Unknown segment {}.".format(command[1]))
+            body.append((PUSH if name == "push" else POP) + segment)
+            write_varint(body, int(command[2]))
+        elif name in LABEL_CODES:
+            body.append(LABEL_CODES[name])
+            write_varint(body, string_id(command[1]))
+        elif name == "call" or name == "function":
+            body.append(CALL if name == "call" else FUNCTION)
+            write_varint(body, string_id(command[1]))
+            write_varint(body, int(command[2]))
+        elif name == "return":
+            body.append(RETURN)
+        else:
+            raise Exception("Command {} cannot be encoded.".format(name))
+
+    output = bytearray(MAGIC)
+    write_varint(output, len(strings))
+    for name in strings:
+        encoded = name.encode()
+        write_varint(output, len(encoded))
+        output += encoded
+    write_varint(output, len(commands))
+    return bytes(output + body)
+
+def decode(data):
+    if data[:len(MAGIC)] != MAGIC:
+        raise Exception("Not a binary VM file.")
+    position = len(MAGIC)
+
+    total_strings, position = read_varint(data, position)
+    strings = []
+    for _ in range(total_strings):
+        length, position = read_varint(data, position)
+        check_length(data, position, length)
+        strings.append(data[position:position + length].decode())
+        position += length
+
+    total_commands, position = read_varint(data, position)
+    commands = []
+    for _ in range(total_commands):
+        check_length(data, position, 1)
+        code = data[position]
+        position += 1
+        if code < len(ARITHMETIC):
+            commands.append((ARITHMETIC[code],))
+        elif PUSH <= code < PUSH + len(SEGMENTS):
+            index, position = read_varint(data, position)
+            commands.append(("push", SEGMENTS[code - PUSH], index))
+        elif POP <= code < POP + len(SEGMENTS):
+            index, position = read_varint(data, position)
+            commands.append(("pop", SEGMENTS[code - POP], index))
+        elif code in LABEL_COMMANDS:
+            name, position = read_string_id(data, position, strings)
+            commands.append((LABEL_COMMANDS[code], name))
+        elif code == CALL or code == FUNCTION:
+            name, position = read_string_id(data, position, strings)
+            count, position = read_varint(data, position)
+            commands.append(("call" if code == CALL else "function", name, count))
+        elif code == RETURN:
+            commands.append(("return",))
+        else:
+            raise Exception("Unknown opcode {} at offset {}.".format(code, position - 1))
+    return commands
+
+def to_text(data):
+    return VMWriter.format_commands(decode(data))
+
+def main():
+    if len(sys.argv) < 2:
+        raise SystemExit("Usage: {} <file.vmb> [output.vm]".format(sys.argv[0]))
+    with open(sys.argv[1], "rb") as f:
+        text = to_text(f.read())
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,655 @@
+import os
+import sys
+import json
+import argparse
+import VMBinary
+from SignatureIndex import OS_CLASSES, os_cost, os_arity
+from VMWriter import parse_commands
+
+# RAM layout of the Hack platform
+SP, LCL, ARG, THIS, THAT = 0, 1, 2, 3, 4
+TEMP_BASE = 5
+STATIC_BASE = 16
+STACK_BASE = 256
+HEAP_BASE = 2048
+HEAP_END = 16384
+SCREEN = 16384
+KEYBOARD = 24576
+RAM_SIZE = 32768
+
+# Pre-decoded opcodes, roughly ordered by how often they run
+(PUSH_CONSTANT, PUSH_LOCAL, PUSH_ARGUMENT, PUSH_THIS, PUSH_THAT, PUSH_STATIC, PUSH_TEMP, PUSH_POINTER,
+ POP_LOCAL, POP_ARGUMENT, POP_THIS, POP_THAT, POP_STATIC, POP_TEMP, POP_POINTER,
+ ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT,
+ GOTO, IF_GOTO, CALL, CALL_NATIVE, FUNCTION, RETURN) = range(30)
+
+PUSH_CODES = {"constant": PUSH_CONSTANT, "local": PUSH_LOCAL, "argument": PUSH_ARGUMENT, "this": PUSH_THIS,
+              "that": PUSH_THAT, "static": PUSH_STATIC, "temp": PUSH_TEMP, "pointer": PUSH_POINTER}
+POP_CODES = {"local": POP_LOCAL, "argument": POP_ARGUMENT, "this": POP_THIS, "that": POP_THAT,
+             "static": POP_STATIC, "temp": POP_TEMP, "pointer": POP_POINTER}
+ARITHMETIC_CODES = {"add": ADD, "sub": SUB, "neg": NEG, "eq": EQ, "gt": GT, "lt": LT,
+                    "and": AND, "or": OR, "not": NOT}
+
+# Return address that ends the run when Main.main returns to the bootstrap
+HALT = -1
+
+def wrap(value):
+    return ((value + 0x8000) & 0xffff) - 0x8000
+
+def integer_sqrt(value):
+    root = 0
+    while (root + 1) * (root + 1) <= value:
+        root += 1
+    return root
+
+class EmulatorError(Exception):
+    pass
+
+class Halt(Exception):
+    pass
+
+class JackOS:
+    # Python implementations of the Jack OS classes in OS_CLASSES.
+    # Strings live on the heap as [capacity, length, characters...].
+    def __init__(self, emulator, keyboard_input=""):
+        self.emulator = emulator
+        self.ram = emulator.ram
+        self.free_blocks = [[HEAP_BASE, HEAP_END - HEAP_BASE]]
+        self.block_sizes = {}
+        self.output = []
+        self.keyboard_input = list(keyboard_input)
+        self.color = True
+        self.functions = {}
+        for name in dir(self):
+            class_name, _, function_name = name.partition("_")
+            if class_name in OS_CLASSES and function_name:
+                self.functions["{}.{}".format(class_name, function_name)] = getattr(self, name)
+
+    def error(self, code):
+        raise EmulatorError("Sys.error {}".format(code))
+
+    # Sys
+    def Sys_halt(self):
+        raise Halt()
+
+    def Sys_error(self, code):
+        self.error(code)
+
+    def Sys_wait(self, duration):
+        return 0
+
+    # Math
+    def Math_init(self):
+        return 0
+
+    def Math_abs(self, x):
+        return wrap(abs(x))
+
+    def Math_multiply(self, x, y):
+        return wrap(x * y)
+
+    def Math_divide(self, x, y):
+        if y == 0:
+            self.error(3)
+        quotient = abs(x) // abs(y)
+        return wrap(-quotient if (x < 0) != (y < 0) else quotient)
+
+    def Math_min(self, x, y):
+        return min(x, y)
+
+    def Math_max(self, x, y):
+        return max(x, y)
+
+    def Math_sqrt(self, x):
+        if x < 0:
+            self.error(4)
+        return integer_sqrt(x)
+
+    # Memory
+    def Memory_init(self):
+        return 0
+
+    def Memory_peek(self, address):
+        return self.ram[address & 0x7fff]
+
+    def Memory_poke(self, address, value):
+        self.ram[address & 0x7fff] = value
+        return 0
+
+    def Memory_alloc(self, size):
+        if size <= 0:
+            self.error(5)
+        for block in self.free_blocks:
+            if block[1] >= size:
+                address = block[0]
+                block[0] += size
+                block[1] -= size
+                if block[1] == 0:
+                    self.free_blocks.remove(block)
+                self.block_sizes[address] = size
+                for offset in range(size):
+                    self.ram[address + offset] = 0
+                return address
+        self.error(6)
+
+    def Memory_deAlloc(self, address):
+        size = self.block_sizes.pop(address, None)
+        if size is not None:
+            self.free_blocks.append([address, size])
+        return 0
+
+    # Array
+    def Array_new(self, size):
+        if size <= 0:
+            self.error(2)
+        return self.Memory_alloc(size)
+
+    def Array_dispose(self, this):
+        return self.Memory_deAlloc(this)
+
+    # String
+    def String_new(self, capacity):
+        if capacity < 0:
+            self.error(14)
+        address = self.Memory_alloc(capacity + 2)
+        self.ram[address] = capacity
+        self.ram[address + 1] = 0
+        return address
+
+    def String_dispose(self, this):
+        return self.Memory_deAlloc(this)
+
+    def String_length(self, this):
+        return self.ram[this + 1]
+
+    def String_charAt(self, this, index):
+        if index < 0 or index >= self.ram[this + 1]:
+            self.error(15)
+        return self.ram[this + 2 + index]
+
+    def String_setCharAt(self, this, index, character):
+        if index < 0 or index >= self.ram[this + 1]:
+            self.error(16)
+        self.ram[this + 2 + index] = character
+        return 0
+
+    def String_appendChar(self, this, character):
+        length = self.ram[this + 1]
+        if length >= self.ram[this]:
+            self.error(17)
+        self.ram[this + 2 + length] = character
+        self.ram[this + 1] = length + 1
+        return this
+
+    def String_eraseLastChar(self, this):
+        if self.ram[this + 1] == 0:
+            self.error(18)
+        self.ram[this + 1] -= 1
+        return 0
+
+    def String_intValue(self, this):
+        text = self.to_python_string(this)
+        sign = -1 if text.startswith("-") else 1
+        digits = ""
+        for character in text.lstrip("-"):
+            if not character.isdigit():
+                break
+            digits += character
+        return wrap(sign * int(digits)) if digits else 0
+
+    def String_setInt(self, this, value):
+        text = str(value)
+        if len(text) > self.ram[this]:
+            self.error(19)
+        for index, character in enumerate(text):
+            self.ram[this + 2 + index] = ord(character)
+        self.ram[this + 1] = len(text)
+        return 0
+
+    def String_newLine(self):
+        return 128
+
+    def String_backSpace(self):
+        return 129
+
+    def String_doubleQuote(self):
+        return 34
+
+    def to_python_string(self, address):
+        length = self.ram[address + 1]
+        return "".join(chr(self.ram[address + 2 + index]) for index in range(length))
+
+    # Output
+    def Output_init(self):
+        return 0
+
+    def Output_moveCursor(self, row, column):
+        return 0
+
+    def Output_printChar(self, character):
+        self.output.append("\n" if character == 128 else chr(character))
+        return 0
+
+    def Output_printString(self, string):
+        self.output.append(self.to_python_string(string))
+        return 0
+
+    def Output_printInt(self, value):
+        self.output.append(str(value))
+        return 0
+
+    def Output_println(self):
+        self.output.append("\n")
+        return 0
+
+    def Output_backSpace(self):
+        if self.output:
+            self.output[-1] = self.output[-1][:-1]
+        return 0
+
+    # Screen
+    def Screen_init(self):
+        return 0
+
+    def Screen_clearScreen(self):
+        for address in range(SCREEN, KEYBOARD):
+            self.ram[address] = 0
+        return 0
+
+    def Screen_setColor(self, color):
+        self.color = color != 0
+        return 0
+
+    def Screen_drawPixel(self, x, y):
+        if x < 0 or x > 511 or y < 0 or y > 255:
+            self.error(7)
+        address = SCREEN + y * 32 + x // 16
+        mask = 1 << (x % 16)
+        word = self.ram[address] & 0xffff
+        word = word | mask if self.color else word & ~mask
+        self.ram[address] = wrap(word)
+        return 0
+
+    def Screen_drawLine(self, x1, y1, x2, y2):
+        dx, dy = abs(x2 - x1), -abs(y2 - y1)
+        step_x = 1 if x1 < x2 else -1
+        step_y = 1 if y1 < y2 else -1
+        error = dx + dy
+        while True:
+            self.Screen_drawPixel(x1, y1)
+            if x1 == x2 and y1 == y2:
+                return 0
+            doubled = 2 * error
+            if doubled >= dy:
+                error += dy
+                x1 += step_x
+            if doubled <= dx:
+                error += dx
+                y1 += step_y
+
+    def Screen_drawRectangle(self, x1, y1, x2, y2):
+        for y in range(y1, y2 + 1):
+            for x in range(x1, x2 + 1):
+                self.Screen_drawPixel(x, y)
+        return 0
+
+    def Screen_drawCircle(self, x, y, radius):
+        for dy in range(-radius, radius + 1):
+            half = integer_sqrt(radius * radius - dy * dy)
+            for dx in range(-half, half + 1):
+                self.Screen_drawPixel(x + dx, y + dy)
+        return 0
+
+    # Keyboard
+    def Keyboard_init(self):
+        return 0
+
+    def Keyboard_keyPressed(self):
+        return ord(self.keyboard_input[0]) if self.keyboard_input else 0
+
+    def Keyboard_readChar(self):
+        if not self.keyboard_input:
+            raise EmulatorError("Keyboard input exhausted")
+        character = self.keyboard_input.pop(0)
+        self.output.append(character)
+        return 128 if character == "\n" else ord(character)
+
+    def Keyboard_readLine(self, message):
+        self.Output_printString(message)
+        line = []
+        while True:
+            character = self.Keyboard_readChar()
+            if character == 128:
+                break
+            line.append(character)
+        string = self.String_new(max(len(line), 1))
+        for character in line:
+            self.String_appendChar(string, character)
+        return string
+
+    def Keyboard_readInt(self, message):
+        return self.String_intValue(self.Keyboard_readLine(message))
+
+class VMEmulator:
+    def __init__(self, keyboard_input=""):
+        self.ram = [0] * RAM_SIZE
+        self.units = []
+        self.os = JackOS(self, keyboard_input)
+        self.program = None
+        self.counts = None
+        self.native_calls = {}
+        # VM instructions executed and the estimated steps of the OS calls,
+        # which run natively here; see SignatureIndex.OS_COSTS
+        self.steps = 0
+        self.os_steps = 0
+
+    def load_commands(self, unit, commands):
+        self.units.append((unit, list(commands)))
+        self.program = None
+
+    def load_file(self, filename):
+        if filename.endswith(".vmb"):
+            with open(filename, "rb") as f:
+                commands = VMBinary.decode(f.read())
+        else:
+            with open(filename) as f:
+                commands = parse_commands(f.read())
+        self.load_commands(os.path.basename(filename).partition(".")[0], commands)
+
+    def load(self, path):
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".vm") or name.endswith(".vmb"):
+                    self.load_file(os.path.join(path, name))
+        else:
+            self.load_file(path)
+
+    def decode(self):
+        # Resolve labels, function addresses and static addresses once, up front
+        commands = []
+        owners = []
+        static_bases = []
+        static_base = STATIC_BASE
+        for unit, unit_commands in self.units:
+            statics = [command[2] for command in unit_commands if len(command) == 3 and command[1] == "static"]
+            static_bases.append(static_base)
+            for command in unit_commands:
+                commands.append(command)
+                owners.append(len(static_bases) - 1)
+            static_base += max(statics) + 1 if statics else 0
+        if static_base > STACK_BASE:
+            raise EmulatorError("Too many static variables")
+
+        # Labels take no time at runtime, so they are dropped and resolved to
+        # the address of the instruction that follows them
+        functions = {}
+        labels = {}
+        function_name = None
+        executable = []
+        executable_owners = []
+        for command, owner in zip(commands, owners):
+            if command[0] == "label":
+                labels[(function_name, command[1])] = len(executable)
+                continue
+            if command[0] == "function":
+                function_name = command[1]
+                functions[function_name] = len(executable)
+            executable.append(command)
+            executable_owners.append(owner)
+        commands, owners = executable, executable_owners
+
+        self.function_ranges = []
+        for name, start in sorted(functions.items(), key=lambda item: item[1]):
+            if self.function_ranges:
+                self.function_ranges[-1][2] = start
+            self.function_ranges.append([name, start, len(commands)])
+
+        program = []
+        function_name = None
+        for address, command in enumerate(commands):
+            operation = command[0]
+            if operation == "function":
+                function_name = command[1]
+                program.append((FUNCTION, command[2], 0))
+            elif operation == "push":
+                index = command[2]
+                if command[1] == "static":
+                    index += static_bases[owners[address]]
+                elif command[1] == "temp":
+                    index += TEMP_BASE
+                program.append((PUSH_CODES[command[1]], index, 0))
+            elif operation == "pop":
+                index = command[2]
+                if command[1] == "static":
+                    index += static_bases[owners[address]]
+                elif command[1] == "temp":
+                    index += TEMP_BASE
+                program.append((POP_CODES[command[1]], index, 0))
+            elif operation in ARITHMETIC_CODES:
+                program.append((ARITHMETIC_CODES[operation], 0, 0))
+            elif operation == "goto" or operation == "if-goto":
+                target = labels.get((function_name, command[1]))
+                if target is None:
+                    raise EmulatorError("Unknown label {} in {}".format(command[1], function_name))
+                program.append((GOTO if operation == "goto" else IF_GOTO, target, 0))
+            elif operation == "call":
+                if command[1] in functions:
+                    program.append((CALL, functions[command[1]], int(command[2])))
+                elif command[1] in self.os.functions:
+                    if int(command[2]) != os_arity(command[1]):
+                        raise EmulatorError("{} called with {} arguments from {}, expects {}".format(
+                            command[1], command[2], function_name, os_arity(command[1])))
+                    program.append((CALL_NATIVE, command[1], int(command[2])))
+                else:
+                    raise EmulatorError("Unknown function {} called from {}".format(command[1], function_name))
+            elif operation == "return":
+                program.append((RETURN, 0, 0))
+            else:
+                raise EmulatorError("Unknown command {}".format(" ".join(map(str, command))))
+
+        self.commands = commands
+        self.functions = functions
+        self.program = program
+
+    def run(self, entry="Main.main", max_steps=None):
+        if self.program is None:
+            self.decode()
+        if "Sys.init" in self.functions:
+            entry = "Sys.init"
+        if entry not in self.functions:
+            raise EmulatorError("Entry point {} not found".format(entry))
+
+        ram = self.ram
+        program = self.program
+        natives = self.os.functions
+        costs = {name: os_cost(name) for name in natives}
+        counts = [0] * len(program)
+        native_calls = self.native_calls
+        os_steps = 0
+
+        # Bootstrap: call the entry point with a return address that halts
+        sp = STACK_BASE
+        ram[sp:sp + 5] = [HALT, 0, 0, 0, 0]
+        sp += 5
+        arg = sp - 5
+        lcl = sp
+        this = that = 0
+        pc = self.functions[entry]
+        steps = 0
+        limit = max_steps if max_steps is not None else -1
+
+        try:
+            while pc != HALT:
+                if steps == limit:
+                    raise EmulatorError("Step limit of {} reached".format(max_steps))
+                steps += 1
+                counts[pc] += 1
+                opcode, a, b = program[pc]
+                pc += 1
+
+                if opcode == PUSH_CONSTANT:
+                    ram[sp] = a
+                    sp += 1
+                elif opcode == PUSH_LOCAL:
+                    ram[sp] = ram[lcl + a]
+                    sp += 1
+                elif opcode == PUSH_ARGUMENT:
+                    ram[sp] = ram[arg + a]
+                    sp += 1
+                elif opcode == PUSH_THIS:
+                    ram[sp] = ram[this + a]
+                    sp += 1
+                elif opcode == PUSH_THAT:
+                    ram[sp] = ram[that + a]
+                    sp += 1
+                elif opcode == PUSH_STATIC or opcode == PUSH_TEMP:
+                    ram[sp] = ram[a]
+                    sp += 1
+                elif opcode == PUSH_POINTER:
+                    ram[sp] = that if a else this
+                    sp += 1
+                elif opcode == POP_LOCAL:
+                    sp -= 1
+                    ram[lcl + a] = ram[sp]
+                elif opcode == POP_ARGUMENT:
+                    sp -= 1
+                    ram[arg + a] = ram[sp]
+                elif opcode == POP_THIS:
+                    sp -= 1
+                    ram[this + a] = ram[sp]
+                elif opcode == POP_THAT:
+                    sp -= 1
+                    ram[that + a] = ram[sp]
+                elif opcode == POP_STATIC or opcode == POP_TEMP:
+                    sp -= 1
+                    ram[a] = ram[sp]
+                elif opcode == POP_POINTER:
+                    sp -= 1
+                    if a:
+                        that = ram[sp] & 0x7fff
+                    else:
+                        this = ram[sp] & 0x7fff
+                elif opcode == ADD:
+                    sp -= 1
+                    ram[sp - 1] = ((ram[sp - 1] + ram[sp] + 0x8000) & 0xffff) - 0x8000
+                elif opcode == SUB:
+                    sp -= 1
+                    ram[sp - 1] = ((ram[sp - 1] - ram[sp] + 0x8000) & 0xffff) - 0x8000
+                elif opcode == NEG:
+                    ram[sp - 1] = ((0x8000 - ram[sp - 1]) & 0xffff) - 0x8000
+                elif opcode == EQ:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] == ram[sp] else 0
+                elif opcode == GT:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] > ram[sp] else 0
+                elif opcode == LT:
+                    sp -= 1
+                    ram[sp - 1] = -1 if ram[sp - 1] < ram[sp] else 0
+                elif opcode == AND:
+                    sp -= 1
+                    ram[sp - 1] = ram[sp - 1] & ram[sp]
+                elif opcode == OR:
+                    sp -= 1
+                    ram[sp - 1] = ram[sp - 1] | ram[sp]
+                elif opcode == NOT:
+                    ram[sp - 1] = ~ram[sp - 1]
+                elif opcode == GOTO:
+                    pc = a
+                elif opcode == IF_GOTO:
+                    sp -= 1
+                    if ram[sp]:
+                        pc = a
+                elif opcode == CALL:
+                    ram[sp] = pc
+                    ram[sp + 1] = lcl
+                    ram[sp + 2] = arg
+                    ram[sp + 3] = this
+                    ram[sp + 4] = that
+                    arg = sp - b
+                    sp += 5
+                    lcl = sp
+                    pc = a
+                elif opcode == CALL_NATIVE:
+                    ram[SP], ram[LCL], ram[ARG], ram[THIS], ram[THAT] = sp, lcl, arg, this, that
+                    sp -= b
+                    native_calls[a] = native_calls.get(a, 0) + 1
+                    os_steps += costs[a]
+                    result = natives[a](*ram[sp:sp + b])
+                    ram[sp] = wrap(result or 0)
+                    sp += 1
+                elif opcode == FUNCTION:
+                    for offset in range(a):
+                        ram[sp + offset] = 0
+                    sp += a
+                elif opcode == RETURN:
+                    frame = lcl
+                    pc = ram[frame - 5]
+                    ram[arg] = ram[sp - 1]
+                    sp = arg + 1
+                    that = ram[frame - 1]
+                    this = ram[frame - 2]
+                    arg = ram[frame - 3]
+                    lcl = ram[frame - 4]
+        except Halt:
+            pass
+        finally:
+            ram[SP], ram[LCL], ram[ARG], ram[THIS], ram[THAT] = sp, lcl, arg, this, that
+            self.steps = steps
+            self.os_steps = os_steps
+            self.counts = counts
+
+        return ram[sp - 1] if pc == HALT else None
+
+    def get_output(self):
+        return "".join(self.os.output)
+
+    def total_steps(self):
+        # Steps including the estimated cost of the OS calls, for comparing runs
+        return self.steps + self.os_steps
+
+    def function_counts(self):
+        # Executed VM instructions per function
+        return {name: sum(self.counts[start:end]) for name, start, end in self.function_ranges}
+
+    def report(self, top=20):
+        totals = self.function_counts()
+        lines = ["EXECUTED: {} VM instructions, {} OS calls estimated at {} more, {} steps in all".format(
+            self.steps, sum(self.native_calls.values()), self.os_steps, self.total_steps())]
+        for name, count in sorted(totals.items(), key=lambda item: -item[1])[:top]:
+            if count:
+                lines.append("    {:>10}  {}".format(count, name))
+        return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument("input", nargs="+", help=".vm/.vmb files or directories")
+    parser.add_argument("--max-steps", type=int, help="stop after this many VM instructions")
+    parser.add_argument("--keyboard", default="", help="characters fed to the Keyboard class")
+    parser.add_argument("--top", type=int, default=20, help="number of functions in the report")
+    parser.add_argument("--json", help="write instruction counts to this JSON file")
+    arguments = parser.parse_args()
+
+    emulator = VMEmulator(arguments.keyboard.replace("\\n", "\n"))
+    for path in arguments.input:
+        emulator.load(path)
+    try:
+        emulator.run(max_steps=arguments.max_steps)
+    finally:
+        sys.stdout.write(emulator.get_output())
+        if emulator.os.output and not emulator.get_output().endswith("\n"):
+            print("")
+        if emulator.counts is not None:
+            print(emulator.report(arguments.top))
+
+    if arguments.json:
+        with open(arguments.json, "w") as f:
+            json.dump({
+                "steps": emulator.steps,
+                "os_steps": emulator.os_steps,
+                "functions": emulator.function_counts(),
+                "os_calls": emulator.native_calls
+            }, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+class VMProgram:
+    # Whole-program view of the VM code: every function of every output unit
+    def __init__(self):
+        self.units = {}
+        self.functions = {}
+        self.owners = {}
+
+    def add_unit(self, unit, commands):
+        names = []
+        for command in commands:
+            if command[0] == "function":
+                names.append(command[1])
+                self.functions[command[1]] = [command]
+                self.owners[command[1]] = unit
+            elif not names:
+                raise Exception("Command {} in {} is outside of a function.".format(command, unit))
+            else:
+                self.functions[names[-1]].append(command)
+        self.units[unit] = names
+
+    def get_commands(self, unit):
+        commands = []
+        for name in self.units[unit]:
+            if name in self.functions:
+                commands.extend(self.functions[name])
+        return commands
+
+    def calls(self, name):
+        return [command[1] for command in self.functions[name] if command[0] == "call"]
+
+    def reachable(self, roots):
+        seen = set()
+        pending = [root for root in roots if root in self.functions]
+        while pending:
+            name = pending.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            for target in self.calls(name):
+                # Calls into the OS or other missing code have no body to follow
+                if target in self.functions and target not in seen:
+                    pending.append(target)
+        return seen
+
+    def remove_function(self, name):
+        del self.functions[name]
+        del self.owners[name]
+
+    def size(self):
+        return sum(len(commands) for commands in self.functions.values())
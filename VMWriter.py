@@ -1,33 +1,100 @@
+import os
+import VMBinary
+
+def write_file(output_name, content):
+    # Leave the file (and its timestamp) alone when nothing changed;
+    # returns True when the file was written
+    try:
+        with open(output_name, "rb") as f:
+            if f.read() == content:
+                return False
+    except OSError:
+        pass
+
+    temp_name = "{}.{}.tmp".format(output_name, os.getpid())
+    with open(temp_name, "wb") as f:
+        f.write(content)
+    os.replace(temp_name, output_name)
+    return True
+
+def format_commands(commands):
+    return "".join([" ".join(map(str, command)) + "\n" for command in commands])
+
+def parse_commands(text):
+    commands = []
+    append = commands.append
+    has_comments = "//" in text
+    for line in text.splitlines():
+        if has_comments:
+            line = line.partition("//")[0]
+        parts = line.split()
+        if len(parts) == 3:
+            append((parts[0], parts[1], int(parts[2])))
+        elif parts:
+            append(tuple(parts))
+    return commands
+
 class VMWriter:
-    def __init__(self, output_file):
-        self.output = output_file
-    
+    def __init__(self, output_name=None, optimizer=None):
+        # Commands are buffered as tuples and written in one go by close().
+        # Output names ending in .vmb get the binary format from VMBinary.
+        self.output_name = output_name
+        self.optimizer = optimizer
+        self.commands = []
+        self.changed = False
+
     def write_push(self, segment, index):
-        self.output.write("push {} {}\n".format(segment, index))
+        self.commands.append(("push", segment, index))
 
     def write_pop(self, segment, index):
-        self.output.write("pop {} {}\n".format(segment, index))
+        self.commands.append(("pop", segment, index))
 
     def write_artihmetic(self, command):
-        self.output.write("{}\n".format(command))
+        self.commands.append((command,))
 
     def write_label(self, label):
-        self.output.write("label {}\n".format(label))
+        self.commands.append(("label", label))
 
     def write_goto(self, label):
-        self.output.write("goto {}\n".format(label))
+        self.commands.append(("goto", label))
 
     def write_if(self, label):
-        self.output.write("if-goto {}\n".format(label))
+        self.commands.append(("if-goto", label))
 
     def write_call(self, name, nArgs):
-        self.output.write("call {} {}\n".format(name, nArgs))
+        self.commands.append(("call", name, nArgs))
 
     def write_function(self, name, nLocals):
-        self.output.write("function {} {}\n".format(name, nLocals))
+        self.commands.append(("function", name, nLocals))
 
     def write_return(self):
-        self.output.write("return\n")
+        self.commands.append(("return",))
+
+    def mark(self):
+        return len(self.commands)
+
+    def take(self, mark):
+        # Removes and returns everything written since mark
+        commands = self.commands[mark:]
+        del self.commands[mark:]
+        return commands
+
+    def extend(self, commands):
+        self.commands.extend(commands)
+
+    def get_output(self):
+        return format_commands(self.commands)
+
+    def get_binary_output(self):
+        return VMBinary.encode(self.commands)
 
     def close(self):
-        self.output.close()
\ No newline at end of file
+        if self.optimizer:
+            self.commands = self.optimizer.optimize(self.commands)
+        if self.output_name is None:
+            return
+        if self.output_name.endswith(".vmb"):
+            content = self.get_binary_output()
+        else:
+            content = self.get_output().encode()
+        self.changed = write_file(self.output_name, content)
@@ -0,0 +1,138 @@
+import os
+import time
+import hashlib
+from SignatureIndex import SignatureIndex, scan_header
+from JackTokenizer import token_pattern
+from JackCompiler import (compile_files, get_list_of_files, get_output_file_name, strip_file_name,
+                          link_program, enable_subroutine_cache, merge_statistics,
+                          format_subroutine_cache_report)
+
+def read_identifiers(text):
+    # Every word in the source outside comments and strings; a file can only
+    # compile differently when a class named by one of these appears,
+    # disappears or changes its signatures
+    return frozenset(word for symbol, word, integer, string, error in token_pattern.findall(text) if word)
+
+class Watcher:
+    def __init__(self, input_name, options, interval=0.5, debounce=0.2):
+        self.input_name = input_name
+        self.options = options
+        self.interval = interval
+        self.debounce = debounce
+        # file -> (mtime_ns, size), content digest, identifiers and header signature
+        self.stats = {}
+        self.digests = {}
+        self.identifiers = {}
+        self.signatures = {}
+        self.dirty = set()
+        self.removed = set()
+        self.built_signatures = {}
+        self.class_record = None
+        self.results = {}
+        self.cycles = 0
+        # Unchanged subroutines of a changed file are not parsed again
+        enable_subroutine_cache()
+
+    def poll(self):
+        # Returns True when a file was added, removed or its content changed
+        changed = False
+        current = set()
+        for file in get_list_of_files(self.input_name):
+            try:
+                stat = os.stat(file)
+            except OSError:
+                continue
+            current.add(file)
+            stat_key = (stat.st_mtime_ns, stat.st_size)
+            if self.stats.get(file) == stat_key:
+                continue
+            self.stats[file] = stat_key
+            with open(file, "rb") as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if self.digests.get(file) == digest:
+                continue
+            self.digests[file] = digest
+            text = content.decode(errors="replace")
+            self.identifiers[file] = read_identifiers(text)
+            self.signatures[file] = scan_header(text)
+            self.dirty.add(file)
+            self.removed.discard(file)
+            changed = True
+
+        for file in list(self.stats):
+            if file not in current:
+                for table in [self.stats, self.digests, self.identifiers, self.signatures]:
+                    del table[file]
+                self.dirty.discard(file)
+                self.removed.add(file)
+                changed = True
+        return changed
+
+    def build(self):
+        signatures = {strip_file_name(file): signature.to_json() for file, signature in self.signatures.items()}
+        # Classes that appeared, disappeared or changed their signatures
+        changed_names = frozenset(name for name in signatures.keys() | self.built_signatures.keys()
+                                  if signatures.get(name) != self.built_signatures.get(name))
+        if changed_names or self.class_record is None:
+            self.class_record = SignatureIndex()
+            for file in sorted(self.signatures):
+                self.class_record.add_class(strip_file_name(file), self.signatures[file])
+            # Files that mention one of these classes may compile differently now
+            for file, identifiers in self.identifiers.items():
+                if identifiers & changed_names:
+                    self.dirty.add(file)
+                # With pooled strings Main.main calls the initializer of every class
+                elif (self.options.pool_strings and strip_file_name(file) == "Main"
+                        and signatures.keys() != self.built_signatures.keys()):
+                    self.dirty.add(file)
+        self.built_signatures = signatures
+
+        for file in sorted(self.removed):
+            self.results.pop(file, None)
+            output_name = get_output_file_name(file, self.options.format)
+            if os.path.exists(output_name) and not self.options.whole_program:
+                os.remove(output_name)
+            print("REMOVED: ", file)
+        self.removed = set()
+
+        file_names = sorted(self.dirty)
+        self.dirty = set()
+        results = compile_files(file_names, self.class_record, self.options)
+        if results:
+            print(format_subroutine_cache_report(merge_statistics(results)))
+        failures = 0
+        for file, result in results:
+            self.results[file] = result
+            if result[0] is not None:
+                failures += 1
+                print("ERROR IN {}: {}".format(file, result[0]))
+
+        if self.options.whole_program and self.results:
+            if any(result[0] is not None for result in self.results.values()):
+                print("Not linking while some files fail to compile.")
+            else:
+                link_program(sorted(self.results.items()), self.options)
+        return len(file_names), failures
+
+    def run(self, max_cycles=None):
+        print("WATCHING {} (Ctrl-C to stop)".format(self.input_name))
+        try:
+            while max_cycles is None or self.cycles < max_cycles:
+                if not self.poll():
+                    time.sleep(self.interval)
+                    continue
+                first_change = time.perf_counter()
+                # Wait for a burst of saves to settle before compiling
+                while True:
+                    time.sleep(self.debounce)
+                    if not self.poll():
+                        break
+                start = time.perf_counter()
+                compiled, failures = self.build()
+                end = time.perf_counter()
+                self.cycles += 1
+                print("CYCLE {}: {} files compiled, {} failed, {:.1f} ms build, {:.1f} ms since first change\n".format(
+                    self.cycles, compiled, failures, (end - start) * 1000, (end - first_change) * 1000))
+        except KeyboardInterrupt:
+            print("Stopped watching.")
@@ -0,0 +1,118 @@
+import random
+
+def generate_class(name, subroutines=20, statements=10, seed=0):
+    rng = random.Random(seed)
+    lines = ["class {} {{".format(name), "    field int count, total;", "    static int instances;", ""]
+    lines.append("    constructor {} new(int start) {{".format(name))
+    lines.append("        let count = start;")
+    lines.append("        let total = 0;")
+    lines.append("        return this;")
+    lines.append("    }")
+    for index in range(subroutines):
+        lines.append("")
+        lines.append("    /** Generated subroutine {} */".format(index))
+        lines.append("    method int step{}(int a, int b) {{".format(index))
+        lines.append("        var int x, y, z;")
+        lines.append("        let x = a;")
+        lines.append("        let y = b;")
+        for _ in range(statements):
+            choice = rng.randrange(4)
+            if choice == 0:
+                lines.append("        let x = x + (y * {}) - count; // update".format(rng.randrange(1, 100)))
+            elif choice == 1:
+                lines.append("        while (x < {}) {{ let x = x + 1; }}".format(rng.randrange(100, 1000)))
+            elif choice == 2:
+                lines.append("        if (x > y) { let z = x; } else { let z = y; }")
+            else:
+                lines.append("        let total = total + z;")
+        lines.append("        return x;")
+        lines.append("    }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+def generate_source(target_size, name="Main"):
+    # Concatenate generated classes until the text is at least target_size characters
+    chunks = []
+    size = 0
+    seed = 0
+    while size < target_size:
+        chunk = generate_class(name, seed=seed)
+        chunks.append(chunk)
+        size += len(chunk)
+        seed += 1
+    return "".join(chunks)
+
+OPERATORS = ["+", "-", "*", "&", "|"]
+WORDS = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "kappa"]
+
+def generate_expression(rng, names, depth):
+    # Left-nested so the nesting depth grows linearly with the text
+    if depth == 0:
+        if rng.randrange(3) == 0:
+            return str(rng.randrange(1, 100))
+        return rng.choice(names)
+    return "({} {} {})".format(generate_expression(rng, names, depth - 1), rng.choice(OPERATORS), rng.choice(names))
+
+def generate_statement(rng, names, depth, string_density, classes):
+    if rng.random() < string_density:
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randrange(1, 6)))
+        return ['do Output.printString("{}");'.format(text)]
+    choice = rng.randrange(5)
+    target = rng.choice(names)
+    if choice == 0:
+        return ["if ({} > {}) {{".format(rng.choice(names), generate_expression(rng, names, depth)),
+                "    let {} = {};".format(target, generate_expression(rng, names, depth)),
+                "} else {",
+                "    let {} = {};".format(target, rng.choice(names)),
+                "}"]
+    if choice == 1:
+        return ["while ({} < {}) {{".format(target, rng.randrange(100, 1000)),
+                "    let {0} = {0} + 1;".format(target),
+                "}"]
+    if choice == 2:
+        return ["let {} = {}.helper({}, {});".format(target, rng.choice(classes), rng.choice(names), rng.choice(names))]
+    return ["let {} = {};".format(target, generate_expression(rng, names, depth))]
+
+def generate_project(classes=4, subroutines=10, statements=20, depth=3, string_density=0.1, identifiers=4, seed=0):
+    # Returns {class name: source} for a project that compiles as a whole:
+    # classes C0..Cn-1 plus a Main that constructs each of them
+    rng = random.Random(seed)
+    names = ["C{}".format(index) for index in range(classes)]
+    fields = ["f{}".format(index) for index in range(identifiers)]
+    parameters = ["p{}".format(index) for index in range(identifiers)]
+    variables = ["v{}".format(index) for index in range(identifiers)]
+    project = {}
+
+    for name in names:
+        lines = ["class {} {{".format(name),
+                 "    field int {};".format(", ".join(fields)),
+                 "    static int {};".format(", ".join("s{}".format(index) for index in range(identifiers))),
+                 "",
+                 "    constructor {} new({}) {{".format(name, ", ".join("int " + p for p in parameters))]
+        for field, parameter in zip(fields, parameters):
+            lines.append("        let {} = {};".format(field, parameter))
+        lines += ["        return this;", "    }", "",
+                  "    function int helper(int a, int b) {",
+                  "        return a + b;",
+                  "    }"]
+        for index in range(subroutines):
+            lines += ["", "    /** Generated subroutine {} */".format(index),
+                      "    method int run{}({}) {{".format(index, ", ".join("int " + p for p in parameters)),
+                      "        var int {};".format(", ".join(variables))]
+            in_scope = fields + parameters + variables
+            for _ in range(statements):
+                for line in generate_statement(rng, in_scope, depth, string_density, names):
+                    lines.append("        " + line)
+            lines += ["        return {};".format(variables[0]), "    }"]
+        lines.append("}")
+        project[name] = "\n".join(lines) + "\n"
+
+    arguments = ", ".join(str(index + 1) for index in range(identifiers))
+    lines = ["class Main {", "    function void main() {"]
+    lines += ["        var {} o{};".format(name, index) for index, name in enumerate(names)]
+    for index, name in enumerate(names):
+        lines.append("        let o{} = {}.new({});".format(index, name, arguments))
+        lines.append("        do o{}.run0({});".format(index, arguments))
+    lines += ["        return;", "    }", "}"]
+    project["Main"] = "\n".join(lines) + "\n"
+    return project
@@ -0,0 +1,101 @@
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from corpus import generate_project
+
+def compile_units(sources, optimize, pool_strings):
+    # Returns [(class name, VM commands)] for a {class name: source} project,
+    # without unreachable functions as in a --format asm build
+    from JackCompiler import compile_sources
+    from VMWriter import parse_commands
+    from VMProgram import VMProgram
+    from DeadCodeEliminator import DeadCodeEliminator
+
+    outputs = compile_sources(sources, optimize=optimize, pool_strings=pool_strings)
+    program = VMProgram()
+    for name in sorted(outputs):
+        program.add_unit(name, parse_commands(outputs[name]))
+    DeadCodeEliminator().eliminate(program)
+    return [(name, program.get_commands(name)) for name in program.units]
+
+def run_vm(units, max_steps):
+    from VMEmulator import VMEmulator
+
+    emulator = VMEmulator()
+    for name, commands in units:
+        emulator.load_commands(name, commands)
+    emulator.run(max_steps=max_steps)
+    return emulator.steps, emulator.get_output()
+
+def translate(units, writer_class):
+    writer = writer_class()
+    writer.write_program(units)
+    return writer
+
+def run_hack(writer, max_cycles):
+    from HackEmulator import HackEmulator
+
+    emulator = HackEmulator()
+    emulator.load_lines(writer.lines)
+    emulator.run(max_cycles=max_cycles)
+    return emulator.cycles, emulator.get_output()
+
+def read_project(directory):
+    sources = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".jack"):
+            with open(os.path.join(directory, name)) as f:
+                sources[name[:-len(".jack")]] = f.read()
+    return sources
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument("projects", nargs="*", help="directories of .jack files (default: a generated project)")
+    parser.add_argument("--classes", type=int, default=4, help="classes of the generated project")
+    parser.add_argument("--subroutines", type=int, default=10, help="methods per generated class")
+    parser.add_argument("--statements", type=int, default=20, help="statements per generated method")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-O", "--optimize", action="store_true", help="run the peephole optimizer first")
+    parser.add_argument("--pool-strings", action="store_true")
+    parser.add_argument("--max-cycles", type=int, default=100000000, help="stop a run after this many cycles")
+    return parser.parse_args()
+
+def main():
+    from HackWriter import HackWriter, NaiveHackWriter
+    from VMEmulator import EmulatorError
+
+    arguments = parse_arguments()
+    projects = [(directory, read_project(directory)) for directory in arguments.projects]
+    if not projects:
+        projects.append(("generated", generate_project(arguments.classes, arguments.subroutines,
+                                                       arguments.statements, seed=arguments.seed)))
+
+    for name, sources in projects:
+        units = compile_units(sources, arguments.optimize, arguments.pool_strings)
+        steps, expected = run_vm(units, arguments.max_cycles)
+        naive, optimized = translate(units, NaiveHackWriter), translate(units, HackWriter)
+        print("{}: {} VM instructions executed".format(name, steps))
+        print("    ROM     {:8} naive  {:8} optimized  ({:+.0%})".format(
+            naive.rom_size(), optimized.rom_size(), optimized.rom_size() / naive.rom_size() - 1))
+
+        cycles = {}
+        for label, writer in [("naive", naive), ("optimized", optimized)]:
+            try:
+                cycles[label], output = run_hack(writer, arguments.max_cycles)
+            except EmulatorError as error:
+                print("    {} assembly not run: {}".format(label, error))
+                continue
+            # Both expansions must behave like the VM code they came from
+            if output != expected:
+                raise SystemExit("{}: {} assembly printed {!r}, the VM emulator {!r}".format(
+                    name, label, output[:200], expected[:200]))
+        if len(cycles) == 2:
+            print("    cycles  {:8} naive  {:8} optimized  ({:+.0%}), {:.1f} -> {:.1f} per VM instruction".format(
+                cycles["naive"], cycles["optimized"], cycles["optimized"] / cycles["naive"] - 1,
+                cycles["naive"] / steps, cycles["optimized"] / steps))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import json
+import platform
+import argparse
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from corpus import generate_project
+
+STATEMENT_KEYWORDS = frozenset(["let", "do", "if", "while", "return"])
+
+# Metrics where a higher value is better; everything else is a cost
+THROUGHPUT_METRICS = ["tokens_per_second", "statements_per_second"]
+COST_METRICS = ["compile_seconds", "peak_rss_kb"]
+
+def peak_rss_kilobytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(directory, repeat):
+    from SignatureIndex import SignatureIndex
+    from JackToken import KEYWORD
+    from JackTokenizer import JackTokenizer
+    from CompilationEngine import CompilationEngine
+    from PhaseProfiler import PhaseProfiler
+
+    file_names = sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".jack"))
+    class_record = SignatureIndex()
+    for file_name in file_names:
+        class_record.scan_file(file_name, os.path.basename(file_name)[:-len(".jack")])
+
+    best = None
+    for _ in range(repeat):
+        tokens = statements = 0
+        lex_seconds = compile_seconds = 0.0
+        for file_name in file_names:
+            # Symbols are resolved while parsing, so compile time includes resolution
+            profiler = PhaseProfiler()
+            tokenizer = JackTokenizer(file_name, profiler)
+            tokens += len(tokenizer.tokens)
+            statements += sum(1 for token in tokenizer.tokens
+                              if token.type == KEYWORD and token.token in STATEMENT_KEYWORDS)
+            CompilationEngine(tokenizer, None, class_record, profiler=profiler)
+            lex_seconds += profiler.seconds["io"] + profiler.seconds["tokenize"]
+            compile_seconds += profiler.seconds["parse"] + profiler.seconds["write"]
+        run = (lex_seconds + compile_seconds, lex_seconds, compile_seconds)
+        if best is None or run < best:
+            best = run
+
+    total_seconds, lex_seconds, compile_seconds = best
+    return {
+        "files": len(file_names),
+        "bytes": sum(os.path.getsize(file_name) for file_name in file_names),
+        "tokens": tokens,
+        "statements": statements,
+        "lex_seconds": round(lex_seconds, 4),
+        "compile_seconds": round(compile_seconds, 4),
+        "tokens_per_second": round(tokens / lex_seconds),
+        "statements_per_second": round(statements / compile_seconds),
+        "peak_rss_kb": peak_rss_kilobytes()
+    }
+
+def write_project(directory, project):
+    for name, source in project.items():
+        with open(os.path.join(directory, name + ".jack"), "w") as f:
+            f.write(source)
+
+def compare(results, baseline, threshold):
+    # Returns a line per metric that got worse by more than threshold
+    previous = {result["scale"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get(result["scale"])
+        if old is None:
+            continue
+        for metric in THROUGHPUT_METRICS + COST_METRICS:
+            if not old.get(metric) or metric not in result:
+                continue
+            ratio = result[metric] / old[metric]
+            worse = ratio < 1 - threshold if metric in THROUGHPUT_METRICS else ratio > 1 + threshold
+            if worse:
+                regressions.append("scale {}: {} {} -> {} ({:+.0%})".format(
+                    result["scale"], metric, old[metric], result[metric], ratio - 1))
+    return regressions
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(prog=sys.argv[0])
+    parser.add_argument("--scales", default="1,2,4,8", help="comma separated multipliers of --classes")
+    parser.add_argument("--classes", type=int, default=4, help="classes at scale 1")
+    parser.add_argument("--subroutines", type=int, default=10, help="methods per class")
+    parser.add_argument("--statements", type=int, default=20, help="statements per method")
+    parser.add_argument("--depth", type=int, default=3, help="expression nesting depth")
+    parser.add_argument("--strings", type=float, default=0.1, help="fraction of statements printing a string literal")
+    parser.add_argument("--identifiers", type=int, default=4, help="length of field, parameter and var lists")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scale, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file from an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change reported as a regression")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    arguments = parse_arguments()
+    if arguments.measure:
+        print(json.dumps(measure(arguments.measure, arguments.repeat)))
+        return
+
+    corpus = {
+        "classes": arguments.classes,
+        "subroutines": arguments.subroutines,
+        "statements": arguments.statements,
+        "depth": arguments.depth,
+        "string_density": arguments.strings,
+        "identifiers": arguments.identifiers,
+        "seed": arguments.seed
+    }
+    results = []
+    for scale in [int(scale) for scale in arguments.scales.split(",")]:
+        with tempfile.TemporaryDirectory() as directory:
+            write_project(directory, generate_project(**dict(corpus, classes=arguments.classes * scale)))
+            # A fresh process per scale so peak RSS is not shared between runs
+            output = subprocess.check_output([sys.executable, __file__, "--measure", directory,
+                                              "--repeat", str(arguments.repeat)])
+        result = dict(json.loads(output), scale=scale)
+        results.append(result)
+        print("scale {scale:3}  {files:4} files  {tokens:8} tokens  {tokens_per_second:8} tokens/s  "
+              "{statements_per_second:7} statements/s  "
+              "peak RSS {peak_rss_kb} KB".format(**result))
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "corpus": corpus,
+        "results": results
+    }
+    if arguments.output:
+        with open(arguments.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if arguments.baseline:
+        with open(arguments.baseline) as f:
+            regressions = compare(results, json.load(f), arguments.threshold)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from corpus import generate_source
+
+def peak_rss_kilobytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measure(mode, filename):
+    from JackTokenizer import JackTokenizer
+    from CompactTokenizer import CompactTokenizer, MappedTokenizer
+
+    baseline = peak_rss_kilobytes()
+    start = time.perf_counter()
+    if mode == "compact":
+        tokenizer = CompactTokenizer(filename)
+        total_tokens = len(tokenizer.types)
+    elif mode == "mapped":
+        tokenizer = MappedTokenizer(filename)
+        total_tokens = len(tokenizer.types)
+    else:
+        tokenizer = JackTokenizer(filename)
+        total_tokens = len(tokenizer.tokens)
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_kilobytes()
+    return {
+        "mode": mode,
+        "tokens": total_tokens,
+        "seconds": round(elapsed, 3),
+        "peak_rss_kb": peak,
+        "bytes_per_token": round((peak - baseline) * 1024 / total_tokens, 1)
+    }
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--measure":
+        print(json.dumps(measure(sys.argv[2], sys.argv[3])))
+        return
+
+    size = int(float(sys.argv[1]) * 1024 * 1024) if len(sys.argv) > 1 else 8 * 1024 * 1024
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "Main.jack")
+        with open(filename, "w") as f:
+            f.write(generate_source(size))
+        print("SOURCE: {:.1f} MB".format(os.path.getsize(filename) / (1024 * 1024)))
+
+        # Each mode runs in a fresh process so peak RSS is not shared
+        for mode in ["list", "compact", "mapped"]:
+            output = subprocess.check_output([sys.executable, __file__, "--measure", mode, filename])
+            result = json.loads(output)
+            print("{mode:8} {tokens} tokens  {seconds}s  peak RSS {peak_rss_kb} KB  ~{bytes_per_token} bytes/token".format(**result))
+
+if __name__ == "__main__":
+    main()
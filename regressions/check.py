@@ -0,0 +1,60 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from JackCompiler import compile_sources
+from VMWriter import parse_commands
+from VMEmulator import VMEmulator, EmulatorError
+from components import checks
+
+# Each directory here is a small program with the output it must print in
+# expected.txt. It is compiled with and without -O and run on the VM
+# emulator; a run that stops with an error prints "ERROR: message".
+
+def read_sources(directory):
+    sources = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".jack"):
+            with open(os.path.join(directory, name)) as f:
+                sources[name[:-len(".jack")]] = f.read()
+    return sources
+
+def run(sources, optimize):
+    emulator = VMEmulator()
+    for name, text in sorted(compile_sources(sources, optimize=optimize).items()):
+        emulator.load_commands(name, parse_commands(text))
+    try:
+        emulator.run(max_steps=10000000)
+    except EmulatorError as error:
+        return emulator.get_output() + "ERROR: {}\n".format(error)
+    return emulator.get_output()
+
+def main():
+    root = os.path.dirname(os.path.abspath(__file__))
+    failures = 0
+    for name in sorted(os.listdir(root)):
+        directory = os.path.join(root, name)
+        if not os.path.isdir(directory) or name.startswith("__"):
+            continue
+        with open(os.path.join(directory, "expected.txt")) as f:
+            expected = f.read()
+        sources = read_sources(directory)
+        for label, optimize in [("plain", False), ("-O", True)]:
+            output = run(sources, optimize)
+            if output != expected:
+                failures += 1
+                print("FAIL {} ({}): printed {!r}, expected {!r}".format(name, label, output, expected))
+        print("checked {}".format(name))
+    for check in checks:
+        try:
+            check()
+        except Exception as error:
+            failures += 1
+            print("FAIL {}: {}: {}".format(check.__name__, type(error).__name__, error))
+        print("checked {}".format(check.__name__))
+    if failures:
+        raise SystemExit("{} regression runs failed".format(failures))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import io
+import os
+import sys
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from JackCompiler import parse_arguments
+from VMEmulator import VMEmulator
+
+# Checks of single components that a program under regressions/ cannot
+# exercise. Each one raises AssertionError with what went wrong.
+
+def expect(condition, message, *values):
+    if not condition:
+        raise AssertionError(message.format(*values))
+
+def write_class(directory, name, source):
+    with open(os.path.join(directory, name + ".jack"), "w") as f:
+        f.write(source)
+
+def run_directory(directory):
+    emulator = VMEmulator()
+    emulator.load(directory)
+    emulator.run(max_steps=1000000)
+    return emulator.get_output()
+
+def check_watch_pooled_classes():
+    # With --pool-strings Main.main calls the string initializer of every
+    # class, so Main has to be rebuilt when a class appears or disappears
+    from Watcher import Watcher
+
+    with tempfile.TemporaryDirectory() as directory:
+        write_class(directory, "Main", """class Main {
+    function void main() {
+        do Output.printString(Foo.name());
+        return;
+    }
+}
+""")
+        foo = """class Foo {
+    function String name() {
+        return "foo";
+    }
+}
+"""
+        write_class(directory, "Foo", foo)
+        watcher = Watcher(directory, parse_arguments([directory, "--watch", "--pool-strings"]))
+
+        def build():
+            with contextlib.redirect_stdout(io.StringIO()):
+                watcher.poll()
+                compiled, failures = watcher.build()
+            expect(failures == 0, "{} files failed to compile", failures)
+            return run_directory(directory)
+
+        expect(build() == "foo", "first build")
+        write_class(directory, "Bar", """class Bar {
+    function String name() {
+        return "bar";
+    }
+}
+""")
+        write_class(directory, "Foo", foo.replace('"foo"', "Bar.name()"))
+        output = build()
+        expect(output == "bar", "printed {!r} after adding Bar", output)
+        os.remove(os.path.join(directory, "Bar.jack"))
+        write_class(directory, "Foo", foo)
+        output = build()
+        expect(output == "foo", "printed {!r} after removing Bar", output)
+
+def check_strength_reduction_cost():
+    import StrengthReduction
+
+    sequence = StrengthReduction.reduce("*", 5)
+    expect(sequence is not None, "x * 5 is not expanded")
+    steps = StrengthReduction.executed_steps(sequence)
+    expect(len(sequence) <= StrengthReduction.MAX_EXPANSION, "x * 5 does not fit the size cap")
+    # The same expansion against an OS whose multiply takes fewer steps
+    cheap_call = {"*": steps, "/": StrengthReduction.CALL_COSTS["/"]}
+    expect(StrengthReduction.reduce("*", 5, cheap_call) is None, "x * 5 is expanded although the call is cheaper")
+    cheap_call["*"] = steps + 1
+    expect(StrengthReduction.reduce("*", 5, cheap_call) == sequence, "x * 5 is not expanded when it is cheaper")
+
+def check_profile_nested_phases():
+    # A deferred compile tokenizes each subroutine while the parse phase runs
+    import time
+    import pstats
+    from PhaseProfiler import PhaseProfiler, PHASES
+    from JackTokenizer import JackTokenizer
+    from CompilationEngine import CompilationEngine
+    from SubroutineCache import SubroutineCache
+    from JackCompiler import get_signature_index
+
+    total_subroutines = 200
+    subroutines = "".join("""    function int f{0}(int x) {{
+        var int y;
+        let y = x + {0};
+        while (y > 0) {{ let y = y - 1; }}
+        return y;
+    }}
+""".format(number) for number in range(total_subroutines))
+    with tempfile.TemporaryDirectory() as directory:
+        write_class(directory, "Main", "class Main {\n" + subroutines + "}\n")
+        file = os.path.join(directory, "Main.jack")
+        index = get_signature_index([file])
+        for profile_name in [None, os.path.join(directory, "Main.prof")]:
+            profiler = PhaseProfiler(profile_name)
+            start = time.perf_counter()
+            tokenizer = JackTokenizer(file, profiler, deferred=True)
+            CompilationEngine(tokenizer, None, index, False, False, profiler, SubroutineCache())
+            wall = time.perf_counter() - start
+            seconds = profiler.get_statistics()
+            total = sum(seconds["profile." + phase] for phase in PHASES)
+            expect(total <= wall, "phases add up to {:.4f}s in {:.4f}s", total, wall)
+            expect(min(seconds["profile.tokenize"], seconds["profile.parse"]) > 0, "phase not timed: {}", seconds)
+            if profile_name:
+                # The parse phase stays profiled after each nested tokenize phase
+                profiler.dump()
+                calls = [stats[0] for (filename, line, name), stats in pstats.Stats(profile_name).stats.items()
+                         if name == "compile_subroutine"]
+                expect(calls == [total_subroutines], "cProfile saw {} compile_subroutine calls", calls)
+
+def check_emulator_os_calls():
+    from VMEmulator import EmulatorError
+    from SignatureIndex import os_cost
+
+    emulator = VMEmulator()
+    emulator.load_commands("Main", [("function", "Main.main", 0), ("push", "constant", 6), ("push", "constant", 7),
+                                    ("call", "Math.multiply", 2), ("return",)])
+    result = emulator.run()
+    expect(result == 42, "Math.multiply returned {}", result)
+    expect(emulator.os_steps == os_cost("Math.multiply"), "OS call charged {} steps", emulator.os_steps)
+    expect(emulator.total_steps() == emulator.steps + emulator.os_steps, "total steps leave out the OS call")
+
+    emulator = VMEmulator()
+    emulator.load_commands("Main", [("function", "Main.main", 0), ("push", "constant", 6),
+                                    ("call", "Math.multiply", 1), ("return",)])
+    try:
+        emulator.run()
+    except EmulatorError as error:
+        expect("Math.multiply called with 1 arguments" in str(error), "unexpected error {}", error)
+    else:
+        raise AssertionError("Math.multiply with one argument ran")
+
+def check_truncated_binary():
+    import VMBinary
+
+    data = VMBinary.encode([("function", "Main.main", 1), ("push", "constant", 300), ("label", "LOOP"),
+                            ("call", "Math.abs", 1), ("if-goto", "LOOP"), ("return",)])
+    for length in range(len(data)):
+        try:
+            VMBinary.decode(data[:length])
+        except Exception as error:
+            # The decoder's own format errors, not IndexError and the like
+            expect(type(error) is Exception, "{} bytes: {}: {}", length, type(error).__name__, error)
+        else:
+            raise AssertionError("{} of {} bytes decoded".format(length, len(data)))
+    expect(len(VMBinary.decode(data)) == 6, "the whole file does not decode")
+
+def check_server_requests():
+    import asyncio
+    from CompileServer import CompileServer, send_request
+
+    async def exchange(directory, requests):
+        address = "unix:" + os.path.join(directory, "server.sock")
+        server = CompileServer(root=os.path.join(directory, "root"))
+        task = asyncio.create_task(server.serve(address))
+        while not os.path.exists(address[len("unix:"):]):
+            await asyncio.sleep(0.01)
+        replies = [await send_request(address, request) for request in requests]
+        await send_request(address, {"command": "shutdown"})
+        await task
+        return replies
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.mkdir(os.path.join(directory, "root"))
+        main = "class Main { function void main() { return; } }"
+        write_class(os.path.join(directory, "root"), "Main", main)
+        write_class(directory, "Outside", main.replace("Main", "Outside"))
+        requests = [
+            {"id": 1, "sources": "notadict"},
+            [1, 2],
+            {"id": 3, "paths": [os.path.join(directory, "Outside.jack")]},
+            {"id": 4, "paths": [os.path.join(directory, "root", "..", "Outside.jack")]},
+            {"id": 5, "paths": [os.path.join(directory, "root")]}
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            replies = asyncio.run(exchange(directory, requests))
+        invalid, not_object, outside, dotted, inside = [[message["type"] for message in reply] for reply in replies]
+        expect(invalid == ["error"] and "sources must be a JSON object" in replies[0][0]["error"],
+               "notadict sources answered with {}", replies[0])
+        expect(not_object == ["error"], "a JSON array was answered with {}", replies[1])
+        for reply, types in [(replies[2], outside), (replies[3], dotted)]:
+            expect(types == ["diagnostic", "done"] and "outside the server root" in reply[0]["error"],
+                   "a file outside the root was answered with {}", reply)
+        expect(not os.path.exists(os.path.join(directory, "Outside.vm")), "a file outside the root was written")
+        expect(inside == ["output", "done"], "a file inside the root was answered with {}", replies[4])
+        expect(os.path.exists(os.path.join(directory, "root", "Main.vm")), "Main.vm was not written")
+
+checks = [
+    check_watch_pooled_classes,
+    check_strength_reduction_cost,
+    check_profile_nested_phases,
+    check_emulator_os_calls,
+    check_truncated_binary,
+    check_server_requests,
+]